@@ -1,25 +1,21 @@
 #!/usr/bin/python
 
-import sys
-import urllib2
+import sys, Queue
+from optparse import OptionParser
 
 from PyQt4 import QtCore, QtGui
 
-
-class DownloadThread(QtCore.QThread):
-    def __init__(self, url, list_widget):
-        QtCore.QThread.__init__(self)
-        self.url = url
-        self.list_widget = list_widget
-
-    def run(self):
-        info = urllib2.urlopen(self.url).info()
-        self.list_widget.addItem('%s\n%s' % (self.url, info))
+import boundedqueue, fetcher, wakeup
 
 
 class MainWindow(QtGui.QWidget):
-    def __init__(self):
+    # Most results added to the list per wakeup before returning to the
+    # event loop
+    batchSize = 200
+
+    def __init__(self, urls, concurrency=8, timeout=10, head=True):
         super(MainWindow, self).__init__()
+        self.urls = urls
         self.list_widget = QtGui.QListWidget()
         self.button = QtGui.QPushButton("Start")
         self.button.clicked.connect(self.start_download)
@@ -28,18 +24,54 @@ class MainWindow(QtGui.QWidget):
         layout.addWidget(self.list_widget)
         self.setLayout(layout)
 
+        # Results come back from the fetcher's workers through a queue and
+        # are added to the list on this thread when the wakeup fires
+        self.wakeup = wakeup.Wakeup()
+        self.results = boundedqueue.BoundedQueue(notify=self.wakeup.notify)
+        self.notifier = QtCore.QSocketNotifier(self.wakeup.fileno(),
+                                               QtCore.QSocketNotifier.Read)
+        self.notifier.activated.connect(self.showResults)
+        self.fetcher = fetcher.Fetcher(self.results.put, concurrency, timeout,
+                                       head)
+
     def start_download(self):
-        urls = ['http://google.com', 'http://twitter.com', 'http://yandex.ru',
-                'http://stackoverflow.com/', 'http://www.youtube.com/']
-        self.threads = []
-        for url in urls:
-            downloader = DownloadThread(url, self.list_widget)
-            self.threads.append(downloader)
-            downloader.start()
+        for url in self.urls:
+            self.fetcher.fetch(url)
+
+    def showResults(self, fd):
+        self.wakeup.clear()
+        items = []
+        while len(items) < self.batchSize:
+            try:
+                items.append(str(self.results.get_nowait()))
+            except Queue.Empty:
+                break
+        self.list_widget.addItems(items)
+        if self.results.qsize():
+            # More left: let the event loop breathe, then carry on
+            QtCore.QTimer.singleShot(0, lambda: self.showResults(fd))
+
+    def closeEvent(self, event):
+        self.notifier.setEnabled(False)
+        # Drop what is still queued and do not wait for the fetches in
+        # flight, so closing never waits for the backlog
+        self.fetcher.close(cancel=True, timeout=0)
+        event.accept()
 
 if __name__ == "__main__":
+    parser = OptionParser(usage='%prog [options] [url ...]')
+    parser.add_option('--get', action='store_true', default=False,
+                      help='fetch whole bodies instead of HEAD only')
+    parser.add_option('--concurrency', type='int', default=8,
+                      help='requests in flight at once')
+    parser.add_option('--timeout', type='float', default=10,
+                      help='per-request timeout in seconds')
+    opts, args = parser.parse_args()
+    urls = args or ['http://google.com', 'http://twitter.com',
+                    'http://yandex.ru', 'http://stackoverflow.com/',
+                    'http://www.youtube.com/']
     app = QtGui.QApplication(sys.argv)
-    window = MainWindow()
+    window = MainWindow(urls, opts.concurrency, opts.timeout, not opts.get)
     window.resize(640, 480)
     window.show()
     sys.exit(app.exec_())
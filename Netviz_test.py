@@ -1,9 +1,18 @@
 #!/usr/bin/python
+# First, so the time spent on the imports below is measured
+import startup
+
 import Tkinter as tk
 import numpy
 from random import randint
-import sys, os
-from scapy.all import *
+import sys, os, threading, time, optparse, Queue
+
+import boundedqueue, canvasrender, capture, decode, discovery, displayfilter
+import pcapreplay, ratehistory, resolver, ringcapture, topology, ttlbaseline
+import wakeup
+from bpf import FilterError
+
+startup.mark('imports')
 
 
 class Netviz_test(tk.Frame):
@@ -34,23 +43,108 @@ class Netviz_test(tk.Frame):
         def __init__(self, x, y):
             self.x = x
             self.y = y
+            # canvas item, once drawn
+            self.item = None
 
         
-    def __init__(self, max_x, max_y, master=None):
+    # Tap colour, and what it flashes to for flashTime seconds whenever a
+    # packet matching the filter is seen
+    tapColor = 'green'
+    matchColor = 'yellow'
+    flashTime = 0.2
+    # What the tap turns to, for alarmTime seconds, when a packet's TTL is
+    # off its source's usual one
+    alarmColor = 'red'
+    alarmTime = 2.0
+
+    # Discovered hosts are coloured by their distance in hops, the last
+    # colour standing for that many hops or more
+    hopColors = ['lightblue', 'palegreen', 'khaki', 'orange', 'tomato']
+    # Discovered hosts are added to the canvas at most this often (ms)
+    topologyInterval = 200
+
+    # Every host and link gets a sparkline of its packet rate, of
+    # sparkWidth x sparkHeight pixels, over sparkLevel of the
+    # ratehistory.RESOLUTIONS, redrawn every rateInterval ms
+    sparkWidth = 40
+    sparkHeight = 12
+    sparkLevel = 0
+    sparkColor = 'steelblue'
+    rateInterval = 1000
+
+    def __init__(self, max_x, max_y, master=None, lookup=None):
         """
-        Initilize NetViz GUI using tk
+        Initilize NetViz GUI using tk. With lookup, see resolver, hosts
+        are labelled with their names.
         """
         tk.Frame.__init__(self, master)
         self.max_x = max_x
         self.max_y = max_y
         self.grid()
+        self.capture = None
+        self.filterExpr = None
+        self.displayFilter = None
         self.createWidgets()
 
+        # Canvas changes from the capture thread go through the renderer,
+        # records for the text window through the queue
+        self.render = canvasrender.CanvasRenderer(self.canvas)
+        self.wakeup = wakeup.Wakeup()
+        self.queue = boundedqueue.BoundedQueue(notify=self.wakeup.notify)
+        self.master.tk.createfilehandler(self.wakeup.fileno(), tk.READABLE,
+                                         self.processIncoming)
+
+        # Hosts and links seen in the traffic, added to the picture by
+        # updateTopology in batches
+        self.discovery = discovery.Discovery()
+        self.topoWakeup = wakeup.Wakeup()
+        self.discovery.notify = self.topoWakeup.notify
+        self.master.tk.createfilehandler(self.topoWakeup.fileno(), tk.READABLE,
+                                         self.scheduleTopology)
+        self.topoScheduled = False
+        # discovery host id -> topology node index, canvas item
+        self.hostNodes = {}
+        self.hostItems = {}
+        # packed address -> canvas label item, relabelled with the host
+        # name once the resolver has one
+        self.hostLabels = {}
+        if lookup:
+            self.resolver = resolver.Resolver(self.nameResolved, lookup)
+        else:
+            self.resolver = None
+
+        # Rate history of every host and link, counted in the capture
+        # thread by address, and the sparkline item drawn for each series
+        self.rates = ratehistory.RateHistory()
+        self.hostAddrs = {}
+        # packed address, or pair of them lowest first -> series
+        self.hostSeries = {}
+        self.linkSeries = {}
+        # series -> canvas line item, and where its sparkline starts
+        self.sparkItems = []
+        self.sparkOrigins = []
+        self.after(self.rateInterval, self.updateRates)
+
+        # Usual TTL of every source, to spot spoofed or rerouted packets;
+        # also what usualttl means in display filters
+        self.baseline = ttlbaseline.TTLBaseline()
+        self.alarmUntil = 0
+
         self.flag = True
 
-        self.s1 = self.Switch(200, self.max_y/4)
-        self.c1 = self.Computer(200, (3*(self.max_y/4)))
-        self.t1 = self.Tap(200, self.max_y/2)
+        # Node positions, kinds and links live in the topology arrays and
+        # are placed by its layout instead of by hand
+        self.topo = topology.Topology()
+        s1 = self.topo.addNode(topology.SWITCH)
+        t1 = self.topo.addNode(topology.TAP)
+        c1 = self.topo.addNode(topology.COMPUTER)
+        self.topo.addEdge(s1, t1)
+        self.topo.addEdge(t1, c1)
+        self.topo.hierarchicalLayout(self.max_x, self.max_y)
+
+        self.s1 = self.Switch(*self.topo.position(s1))
+        self.c1 = self.Computer(*self.topo.position(c1))
+        self.t1 = self.Tap(*self.topo.position(t1))
 
         edge = 10
 
@@ -62,7 +156,8 @@ class Netviz_test(tk.Frame):
 
         c1_img = self.canvas.create_bitmap(c1.x, c1.y, bitmap="@./computer.xbm", tag='c1')
 
-        t1 = self.canvas.create_rectangle((t1.x-edge), (t1.y-edge), (t1.x + edge), (t1.y + edge), fill="red", tag='tap1')
+        t1.item = self.canvas.create_rectangle((t1.x-edge), (t1.y-edge), (t1.x + edge), (t1.y + edge), fill=self.tapColor, tag='tap1')
+        self.render.track(t1.item, fill=self.tapColor)
 
         self.master.title('NetViz')
         # self.addStations()
@@ -80,11 +175,23 @@ class Netviz_test(tk.Frame):
         self.filterEntry.insert(0, "Enter filter")
 
         def callback():
-            print self.filterEntry.get()
+            self.setFilter(self.filterEntry.get())
 
         self.filterButton = tk.Button(self, text="Filter", width=10, command=callback)
         self.filterButton.grid()
 
+        # Which of the captured packets have their TTL shown
+        self.displayEntry = tk.Entry(self)
+        self.displayEntry.grid()
+        self.displayEntry.insert(0, "Enter display filter")
+
+        def displayCallback():
+            self.setDisplayFilter(self.displayEntry.get())
+
+        self.displayButton = tk.Button(self, text="Display", width=10,
+                                       command=displayCallback)
+        self.displayButton.grid()
+
         self.textWindow = tk.Text(self)
         self.textWindow.grid()
 
@@ -92,26 +199,208 @@ class Netviz_test(tk.Frame):
     def quit(self):
         """ Flag boolean is used to stop simulation. """
         self.flag = False
+        if self.resolver:
+            self.resolver.close()
         tk.Frame.quit(self)
 
 
-    def testTTL(pkt):
+    def setFilter(self, expr):
+        """ Refilter the running capture in the kernel, if there is one. """
+        self.filterExpr = expr
+        if self.capture is None:
+            return
+        try:
+            self.capture.setFilter(expr)
+        except FilterError as e:
+            self.filterEntry.config(background='#fcc')
+            print 'Bad filter:', e
+        else:
+            self.filterEntry.config(background='white')
+
+
+    def setDisplayFilter(self, expr):
+        """ Show only the TTLs of packets matching expr from now on. """
+        expr = expr.strip()
         try:
-            if pkt.haslayer(IP):
-                ipsrc=pkt.getlayer(IP).src
-                ttl = str(pkt.ttl)
-                self.textWindow.insert(END, ttl)
+            self.displayFilter = expr and displayfilter.DisplayFilter(
+                expr, baseline=self.baseline) or None
+        except FilterError as e:
+            self.displayEntry.config(background='#fcc')
+            print 'Bad display filter:', e
+        else:
+            self.displayEntry.config(background='white')
+
+
+    def testTTL(self, frame):
+        """ Called in the capture thread for every frame that passed the filter. """
+        rec = decode.decodeFrame(frame)
+        if rec is None:
+            arp = decode.decodeArp(frame)
+            if arp is not None:
+                self.discovery.addArp(arp)
+            return
+        self.discovery.addRecord(rec)
+        self.countRates(rec)
+        now = time.time()
+        self.queue.put((now, rec))
+        # An alarm is not cut short by the flashes of normal packets
+        if self.baseline.add(rec[1], rec[4]):
+            self.alarmUntil = now + self.alarmTime
+            self.render.flash(self.t1.item, 'fill', self.alarmColor,
+                              self.alarmTime)
+        elif now >= self.alarmUntil:
+            self.render.flash(self.t1.item, 'fill', self.matchColor,
+                              self.flashTime)
+
+
+    def countRates(self, rec):
+        """ Count a record against its source host's and its link's rates. """
+        src, dst, length = rec[1], rec[2], rec[5]
+        series = self.hostSeries.get(src)
+        if series is not None:
+            self.rates.add(series, length)
+        series = self.linkSeries.get(src < dst and (src, dst) or (dst, src))
+        if series is not None:
+            self.rates.add(series, length)
+
+
+    def processIncoming(self, fd, mask):
+        """
+        Move the TTLs of queued records into textWindow, in the Tk thread,
+        running the display filter over each batch drained.
+        """
+        self.wakeup.clear()
+        records = []
+        while len(records) < 1000:
+            try:
+                records.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        if records and self.displayFilter:
+            records = self.displayFilter.apply(records)
+        if records:
+            self.textWindow.insert(tk.END, '\n'.join(
+                str(rec[4]) for ts, rec in records) + '\n')
+            startup.firstPacket()
+        if self.queue.qsize():
+            self.after_idle(self.wakeup.notify)
+
+
+    def scheduleTopology(self, fd, mask):
+        self.topoWakeup.clear()
+        if not self.topoScheduled:
+            self.topoScheduled = True
+            self.after(self.topologyInterval, self.updateTopology)
+
+
+    def updateTopology(self):
+        """ Draw the hosts and links discovered since the last call. """
+        self.topoScheduled = False
+        hosts, links, hops = self.discovery.takeChanges()
+        topo = self.topo
+        canvas = self.canvas
+        radius = 5
+
+        for hostId, addr in hosts:
+            self.hostNodes[hostId] = topo.addNode(topology.HOST)
+        for a, b in links:
+            topo.addEdge(self.hostNodes[a], self.hostNodes[b])
+        if hosts:
+            topo.forceLayout(self.max_x, self.max_y, iterations=10,
+                             onlyNew=True)
+
+        for hostId, addr in hosts:
+            x, y = topo.position(self.hostNodes[hostId])
+            item = canvas.create_oval(x - radius, y - radius, x + radius,
+                                      y + radius, fill=self.hopColors[0],
+                                      tag='host')
+            self.render.track(item, fill=self.hopColors[0])
+            self.hostItems[hostId] = item
+            label = canvas.create_text(
+                x, y + 2 * radius, text=decode.formatAddr(addr),
+                anchor=tk.N, font=('TkDefaultFont', 7), tag='hostlabel')
+            # The label must be there before the lookup starts, or a quick
+            # answer finds nothing to relabel and is lost
+            self.hostLabels[addr] = label
+            name = self.resolver and self.resolver.name(addr)
+            if name:
+                canvas.itemconfig(label, text=name)
+            self.hostAddrs[hostId] = addr
+            self.hostSeries[addr] = self.addSparkline(x + 2 * radius, y)
+        for a, b in links:
+            xa, ya = topo.position(self.hostNodes[a])
+            xb, yb = topo.position(self.hostNodes[b])
+            canvas.tag_lower(canvas.create_line(xa, ya, xb, yb, fill='grey',
+                                                tag='link'))
+            addrs = sorted((self.hostAddrs[a], self.hostAddrs[b]))
+            self.linkSeries[tuple(addrs)] = self.addSparkline(
+                (xa + xb) / 2.0 - self.sparkWidth / 2.0, (ya + yb) / 2.0)
+        for hostId, n in hops.iteritems():
+            topo.state[self.hostNodes[hostId]] = min(n, 255)
+            color = self.hopColors[min(n, len(self.hopColors) - 1)]
+            self.render.set(self.hostItems[hostId], fill=color)
+
+
+    def addSparkline(self, x, y):
+        """
+        Start a rate series with its sparkline starting at x, its
+        baseline at y; returns the series.
+        """
+        self.sparkItems.append(self.canvas.create_line(
+            x, y, x + self.sparkWidth, y, fill=self.sparkColor, tag='spark'))
+        self.sparkOrigins.append((x, y))
+        return self.rates.addSeries()
+
+
+    def updateRates(self):
+        """
+        Move the rate history on a second and redraw every sparkline in
+        place, each scaled to its own peak.
+        """
+        self.after(self.rateInterval, self.updateRates)
+        rates = self.rates
+        rates.tick()
+        if not len(rates):
+            return
+        xs, ys = ratehistory.lttb(rates.history(range(len(rates)),
+                                                self.sparkLevel),
+                                  self.sparkWidth)
+        points = rates.resolutions[self.sparkLevel][1]
+        origins = numpy.array(self.sparkOrigins)
+        coords = numpy.empty(xs.shape + (2,))
+        coords[:, :, 0] = origins[:, :1] + \
+            xs * (self.sparkWidth / float(max(points - 1, 1)))
+        peak = numpy.maximum(ys.max(axis=1), 1e-9)[:, None]
+        coords[:, :, 1] = origins[:, 1:] - self.sparkHeight * ys / peak
+        coordsOf = self.canvas.coords
+        for item, line in zip(self.sparkItems, coords.reshape(len(rates), -1)):
+            coordsOf(item, *line.tolist())
 
-        except:
-            pass
 
+    def nameResolved(self, addr, name):
+        """ Called in a resolver thread; relabel the host on the next frame. """
+        item = self.hostLabels.get(addr)
+        if item is not None and name:
+            self.render.set(item, text=name)
 
-    def getPackets(self):
-        """ display packets to textWindow """
+
+    def getPackets(self, replay=None, speed=1.0, ring=False):
+        """
+        display packets to textWindow, live or from a capture file; live
+        with ring through a memory-mapped ring
+        """
 
         numPkts = 0
 
-        sniff(prn=testTTL, store=0)
+        if replay:
+            self.capture = pcapreplay.PcapReplay(replay, speed)
+        elif ring:
+            self.capture = ringcapture.RingCapture()
+        else:
+            self.capture = capture.LiveCapture()
+        self.setFilter(self.filterExpr)
+        startup.mark('capture')
+        self.capture.run(self.testTTL, stopper=lambda: not self.flag)
 
             
 
@@ -140,7 +429,43 @@ if __name__ == "__main__":
     The MarruSim class should be imported and used from an external Python
     program.  If MaruuSim is executed independently, we simply run randomTest.
     """
-    app = Netviz_test(600, 600)
-    app.mainloop()
+    parser = optparse.OptionParser()
+    parser.add_option('--ring', action='store_true', default=False,
+                      help='capture through a memory-mapped ring')
+    parser.add_option('--replay', metavar='FILE',
+                      help='replay a pcap/pcapng file instead of sniffing')
+    parser.add_option('--speed', type='float', default=1.0,
+                      help='replay speed, 1 is real time, 0 flat out')
+    parser.add_option('--resolve', action='store_true', default=False,
+                      help='label hosts with names from reverse DNS')
+    parser.add_option('--hosts', metavar='FILE',
+                      help='label hosts with names from a hosts file')
+    opts, args = parser.parse_args()
+    if opts.replay:
+        # Fail here rather than in the capture thread
+        try:
+            open(opts.replay, 'rb').close()
+        except IOError as e:
+            parser.error('--replay: %s' % e)
+    lookup = None
+    if opts.hosts:
+        try:
+            lookup = resolver.hostsLookup(opts.hosts)
+        except IOError as e:
+            parser.error('--hosts: %s' % e)
+    elif opts.resolve:
+        lookup = resolver.systemLookup
 
-    app.getPackets()
+    app = Netviz_test(600, 600, lookup=lookup)
+    startup.mark('gui')
+
+    capturer = threading.Thread(target=app.getPackets,
+                                kwargs={'replay': opts.replay,
+                                        'speed': opts.speed,
+                                        'ring': opts.ring})
+    capturer.daemon = True
+    capturer.start()
+
+    app.mainloop()
+    if app.resolver:
+        app.resolver.close()
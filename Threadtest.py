@@ -21,10 +21,13 @@ Updated to Qt 4.7 by Dirk Swart, Ithaca, NY. 2011-04-15
 """
 
 import sys, time, threading, random, Queue
+import boundedqueue
 from PyQt4 import QtGui,QtCore as qt
 
 # drr
-from scapy.all import *
+# Just sniff and the IP layer, not every layer scapy.all would load
+from scapy.sendrecv import sniff
+from scapy.layers.inet import IP
 
 
 class GuiPart(QtGui.QMainWindow):
@@ -58,6 +61,7 @@ class GuiPart(QtGui.QMainWindow):
                 self.editor.insertPlainText(str(msg))
             except Queue.Empty:
                 pass
+        self.statusBar().showMessage(self.queue.status())
 
 
 class ThreadedClient:
@@ -67,8 +71,8 @@ class ThreadedClient:
     means that you have all the thread controls in a single place.
     """
     def __init__(self):
-        # Create the queue
-        self.queue = Queue.Queue()
+        # Create the queue, bounded so a slow GUI cannot eat all memory
+        self.queue = boundedqueue.BoundedQueue()
 
         # Set up the GUI part
         self.gui=GuiPart(self.queue, self.endApplication)
@@ -20,48 +20,227 @@ Adapted by Boudewijn Rempt, Netherlands. 2002-04-15
 Updated to Qt 4.7 by Dirk Swart, Ithaca, NY. 2011-04-15
 """
 
-import sys, time, threading, random, Queue
+# First, so the time spent on the imports below is measured
+import startup
+
+import sys, time, threading, random, optparse, socket
+from Queue import Empty
 from PyQt4 import QtGui, QtCore as qt
 
+import aggregate, boundedqueue, capture, capturestore, decode, displayfilter, \
+    lazyscapy, multicapture, packetlog, pcapexport, pipeline, pcapreplay, \
+    resolver, ringcapture, stats, ttlbaseline, wakeup
+from bpf import FilterError
 
+startup.mark('imports')
 
-# drr
-from scapy.all import *
+
+class CounterTable(QtGui.QTableWidget):
+    """
+    Running packet/byte totals per talker or flow, added up from the
+    counters of aggregate.Delta windows and updated in place.
+    """
+    def __init__(self, headers, labels, *args):
+        QtGui.QTableWidget.__init__(self, 0, len(headers) + 3, *args)
+        self.setHorizontalHeaderLabels(headers + ['Packets', 'Bytes', 'Pkts/s'])
+        self.verticalHeader().hide()
+        self.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        self.labels = labels
+        # key -> [packets item, bytes item, rate item, packets, bytes]
+        self.entries = {}
+        self.active = set()
+
+    def addCounts(self, counts, seconds):
+        """
+        Add one window of counts; seconds is the length of the window.
+        """
+        self.setSortingEnabled(False)
+        for key in self.active.difference(counts):
+            self.entries[key][2].setData(qt.Qt.DisplayRole, 0)
+        for key, (packets, nbytes) in counts.iteritems():
+            entry = self.entries.get(key)
+            if entry is None:
+                row = self.rowCount()
+                self.insertRow(row)
+                for col, text in enumerate(self.labels(key)):
+                    self.setItem(row, col, QtGui.QTableWidgetItem(text))
+                entry = [QtGui.QTableWidgetItem() for i in range(3)] + [0, 0]
+                for col, item in enumerate(entry[:3]):
+                    self.setItem(row, self.columnCount() - 3 + col, item)
+                self.entries[key] = entry
+            entry[3] += packets
+            entry[4] += nbytes
+            entry[0].setData(qt.Qt.DisplayRole, entry[3])
+            entry[1].setData(qt.Qt.DisplayRole, entry[4])
+            entry[2].setData(qt.Qt.DisplayRole, int(packets / seconds))
+        self.active = set(counts)
+        self.setSortingEnabled(True)
+
+
+class PacketLogModel(qt.QAbstractListModel):
+    """
+    List model over a packetlog.PacketRing. Rows are only formatted when
+    the view asks for them, which with uniform item sizes is just the
+    ones on screen. So with a resolver, only addresses on screen are
+    ever looked up.
+    """
+    def __init__(self, capacity, *args):
+        qt.QAbstractListModel.__init__(self, *args)
+        self.ring = packetlog.PacketRing(capacity)
+        self.names = None
+
+    def rowCount(self, parent=qt.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.ring)
+
+    def data(self, index, role=qt.Qt.DisplayRole):
+        if role == qt.Qt.DisplayRole and index.isValid():
+            return self.ring.format(index.row(), self.names)
+        return None
+
+    def append(self, records):
+        """
+        Add a batch of (ts, record) pairs, dropping the oldest rows when
+        the ring is full. Returns the number of rows dropped.
+        """
+        ring = self.ring
+        records = records[-ring.capacity:]
+        over = max(len(ring) + len(records) - ring.capacity, 0)
+        if over:
+            self.beginRemoveRows(qt.QModelIndex(), 0, over - 1)
+            ring.discard(over)
+            self.endRemoveRows()
+        if records:
+            first = len(ring)
+            self.beginInsertRows(qt.QModelIndex(), first,
+                                 first + len(records) - 1)
+            ring.extend(records)
+            self.endInsertRows()
+        return over
 
 
 class GuiPart(QtGui.QWidget):
 
+    # Per-tick drain budget for processIncoming. This keeps the time spent
+    # away from the Qt event loop bounded however deep the queue gets.
+    drainItems = 500
+    drainTime = 0.02
 
-    def __init__(self, queue, endcommand, *args):
+    # How often the stats panel is refreshed, in ms
+    statsInterval = 1000
+
+    # Defaults of the state processIncoming reads, for a GuiPart that
+    # skips __init__ (benchmark.py's stub); __init__ sets them anew
+    displayFilter = None
+    baseline = None
+    namesChanged = False
+
+    def __init__(self, queue, endcommand, filtercommand, aggregate=False,
+                 logSize=100000, stats=None, sets=None, baseline=None,
+                 names=None, *args):
 
         super(GuiPart, self).__init__()
 
         self.queue = queue
+        self.stats = stats
         # We show the result of the thread in the gui, instead of the console
 
         filterLabel=QtGui.QLabel('Filter')
-        filterEdit=QtGui.QLineEdit()
+        self.filterEdit=QtGui.QLineEdit()
+        self.filterEdit.returnPressed.connect(self.applyFilter)
+
+        # The display filter picks what goes into the packet log out of
+        # what the capture filter let through; sets are the named address
+        # sets it can refer to as $name
+        displayLabel=QtGui.QLabel('Display')
+        self.displayEdit=QtGui.QLineEdit()
+        self.displayEdit.returnPressed.connect(self.applyDisplayFilter)
+        self.displayFilter = None
+        self.sets = sets
+        self.baseline = baseline
+
+        # Overload counters of the queue, refreshed by processIncoming
+        self.status = QtGui.QLabel(self)
 
         quitButton = QtGui.QPushButton('Quit', self)
         quitButton.clicked.connect(self.quitApp)
 
-        self.editor = QtGui.QTextEdit(self)
+        # Packet log: the last logSize packets in a ring, shown through a
+        # model so only the visible rows are ever formatted
+        self.log = PacketLogModel(logSize, self)
+        # With names, a resolver's name method, rows show host names once
+        # they are known; namesChanged says some arrived since last drawn
+        self.log.names = names
+        self.namesChanged = False
+        self.logView = QtGui.QListView()
+        self.logView.setModel(self.log)
+        self.logView.setUniformItemSizes(True)
+        self.logView.setVerticalScrollMode(
+            QtGui.QAbstractItemView.ScrollPerItem)
+        self.follow = QtGui.QCheckBox('Follow')
+        self.follow.setChecked(True)
+        self.follow.toggled.connect(self.followToggled)
+        self.jumpTime = QtGui.QDateTimeEdit(qt.QDateTime.currentDateTime())
+        self.jumpTime.setDisplayFormat('yyyy-MM-dd HH:mm:ss')
+        jumpButton = QtGui.QPushButton('Jump to time')
+        jumpButton.clicked.connect(self.jumpToTime)
+        logControls = QtGui.QHBoxLayout()
+        logControls.addWidget(self.follow)
+        logControls.addStretch()
+        logControls.addWidget(self.jumpTime)
+        logControls.addWidget(jumpButton)
+        logLayout = QtGui.QVBoxLayout()
+        logLayout.setContentsMargins(0, 0, 0, 0)
+        logLayout.addLayout(logControls)
+        logLayout.addWidget(self.logView)
+        self.logPanel = QtGui.QWidget(self)
+        self.logPanel.setLayout(logLayout)
+
+        # With aggregation the queue carries per-window counters, shown
+        # as talker and flow tables instead of a line per packet
+        self.talkers = CounterTable(['Source', 'TTL'], lambda key:
+            (decode.formatAddr(key[0]), str(key[1])))
+        self.flows = CounterTable(['Source', 'Destination', 'Proto'], lambda key:
+            (decode.formatAddr(key[0]), decode.formatAddr(key[1]), str(key[2])))
+        self.tables = QtGui.QTabWidget(self)
+        self.tables.addTab(self.talkers, 'Talkers')
+        self.tables.addTab(self.flows, 'Flows')
 
         self.grid = QtGui.QGridLayout()
         self.grid.setSpacing(10)
         self.grid.addWidget(filterLabel, 1, 0)
-        self.grid.addWidget(filterEdit, 1, 1)
-
-        self.grid.addWidget(self.editor, 2, 0, 5, 2)
-        self.grid.addWidget(quitButton, 7, 0, 1, 2)
+        self.grid.addWidget(self.filterEdit, 1, 1)
+        self.grid.addWidget(displayLabel, 0, 0)
+        self.grid.addWidget(self.displayEdit, 0, 1)
+
+        if aggregate:
+            self.logPanel.hide()
+            self.grid.addWidget(self.tables, 2, 0, 5, 2)
+        else:
+            self.tables.hide()
+            self.grid.addWidget(self.logPanel, 2, 0, 5, 2)
+        self.grid.addWidget(self.status, 7, 0, 1, 2)
+        self.grid.addWidget(quitButton, 9, 0, 1, 2)
+
+        # Per-stage counters and latencies, refreshed on a timer rather
+        # than per packet
+        if stats:
+            self.statsView = QtGui.QLabel(self)
+            self.statsView.setFont(QtGui.QFont('Monospace'))
+            self.grid.addWidget(self.statsView, 8, 0, 1, 2)
+            self.lastStats = None
+            self.statsTimer = qt.QTimer(self)
+            self.statsTimer.timeout.connect(self.showStats)
+            self.statsTimer.start(self.statsInterval)
 
         self.setLayout(self.grid)
         self.setGeometry(300, 300, 500, 300)
 
         print 'here'
 
-        # self.setCentralWidget(self.editor)
         self.endcommand = endcommand
+        self.filtercommand = filtercommand
 
 
     def quitApp(self):
@@ -69,6 +248,55 @@ class GuiPart(QtGui.QWidget):
         qt.QCoreApplication.instance().quit
 
 
+    def applyFilter(self):
+        """
+        Hand the filter text to the capture thread. A filter that does not
+        compile leaves the old one in place and turns the field red.
+        """
+        expr = str(self.filterEdit.text())
+        try:
+            self.filtercommand(expr)
+        except FilterError as e:
+            self.filterEdit.setStyleSheet('background-color: #fcc')
+            self.filterEdit.setToolTip(str(e))
+        else:
+            self.filterEdit.setStyleSheet('')
+            self.filterEdit.setToolTip(expr)
+
+    def applyDisplayFilter(self):
+        """
+        Show only the packets matching the display filter from now on. As
+        with the capture filter, one that does not compile is not used.
+        """
+        expr = str(self.displayEdit.text()).strip()
+        try:
+            self.displayFilter = expr and displayfilter.DisplayFilter(
+                expr, self.sets, self.baseline) or None
+        except FilterError as e:
+            self.displayEdit.setStyleSheet('background-color: #fcc')
+            self.displayEdit.setToolTip(str(e))
+        else:
+            self.displayEdit.setStyleSheet('')
+            self.displayEdit.setToolTip(expr)
+
+
+    def followToggled(self, on):
+        if on:
+            self.logView.scrollToBottom()
+
+    def jumpToTime(self):
+        """
+        Show the first logged packet at or after the chosen time, and stop
+        following the tail so it stays in view.
+        """
+        self.follow.setChecked(False)
+        row = self.log.ring.find(self.jumpTime.dateTime().toTime_t())
+        row = min(row, self.log.rowCount() - 1)
+        if row >= 0:
+            index = self.log.index(row)
+            self.logView.setCurrentIndex(index)
+            self.logView.scrollTo(index, QtGui.QAbstractItemView.PositionAtTop)
+
     def closeEvent(self, ev):
         """
         We just call the endcommand when the window is closed
@@ -78,16 +306,71 @@ class GuiPart(QtGui.QWidget):
 
     def processIncoming(self):
         """
-        Handle all the messages currently in the queue (if any).
+        Handle the messages currently in the queue, up to drainItems
+        messages or drainTime seconds per call, whichever comes first.
+        Everything drained is added to the packet log in one go; whatever
+        is left stays queued for the next call. Aggregation windows go to
+        the tables. Returns True if the queue still holds messages.
         """
-        while self.queue.qsize():
+        st = self.stats
+        records = []
+        started = time.time()
+        deadline = started + self.drainTime
+        for i in xrange(1, self.drainItems + 1):
             try:
-                msg = self.queue.get(0)
-                # Check contents of message and do what it says
-                # As a test, we simply print it
-                self.editor.insertPlainText(str(msg))
-            except Queue.Empty:
-                pass
+                msg = self.queue.get_nowait()
+            except Empty:
+                break
+            if isinstance(msg, aggregate.Delta):
+                self.showDelta(msg)
+            else:
+                records.append(msg)
+                if st and not i & st.sampleMask:
+                    st.queueTime.add(started - msg[0])
+            # time.time() is cheap but not free; only look every 64 msgs
+            if not i & 63 and time.time() > deadline:
+                break
+
+        # The display filter sees everything drained as one batch
+        if records and self.displayFilter:
+            records = self.displayFilter.apply(records)
+        if records:
+            self.appendLog(records)
+            startup.firstPacket()
+        if self.namesChanged:
+            self.namesChanged = False
+            self.logView.viewport().update()
+        status = self.queue.status()
+        if self.baseline is not None:
+            status += '; TTL ' + self.baseline.status()
+        self.status.setText(status)
+        if st:
+            st.rendered += len(records)
+            st.renderTime.add(time.time() - started)
+
+        return self.queue.qsize() > 0
+
+    def appendLog(self, records):
+        """
+        Add (ts, record) pairs to the log. Following, the view stays on
+        the newest row; otherwise it stays on the rows being looked at
+        while older ones scroll out of the ring underneath.
+        """
+        dropped = self.log.append(records)
+        if self.follow.isChecked():
+            self.logView.scrollToBottom()
+        elif dropped:
+            bar = self.logView.verticalScrollBar()
+            bar.setValue(bar.value() - dropped)
+
+    def showStats(self):
+        self.lastStats = self.stats.snapshot(self.lastStats)
+        self.statsView.setText(stats.formatSnapshot(self.lastStats))
+
+    def showDelta(self, delta):
+        seconds = max(delta.end - delta.start, 1e-3)
+        self.talkers.addCounts(delta.talkers, seconds)
+        self.flows.addCounts(delta.flows, seconds)
 
 
 class ThreadedClient:
@@ -96,21 +379,111 @@ class ThreadedClient:
     endApplication could reside in the GUI part, but putting them here
     means that you have all the thread controls in a single place.
     """
-    def __init__(self):
-        # Create the queue
-        self.queue = Queue.Queue()
+    # Only IP traffic is of interest to testTTL, so the kernel always
+    # filters on this, and on the user's expression if there is one
+    baseFilter = 'ip or ip6'
+
+    # Defaults of the state testTTL and queueRecord read, for a client
+    # that skips __init__ (benchmark.py's stub)
+    baseline = None
+    export = None
+
+    def __init__(self, dissect=False, workers=0, replay=None, speed=1.0,
+                 window=0, queueSize=10000, policy=boundedqueue.DROP_NEWEST,
+                 store=None, statsFile=None, statsInterval=5.0, ifaces=None,
+                 fanout=1, sets=None, lookup=None, ring=False, export=None):
+        # Decode raw frames with the struct fast path unless full scapy
+        # dissection is asked for. Only then is scapy loaded at all, and
+        # only the layers the dissection needs.
+        self.dissect = dissect
+        if dissect:
+            self.layers = lazyscapy.layers()
+            startup.mark('scapy')
+
+        # Create the queue. It is bounded, so when the GUI falls behind
+        # messages are dropped or sampled according to policy instead of
+        # piling up in memory. Every put wakes the GUI thread, see below.
+        self.wakeup = wakeup.Wakeup()
+        self.queue = boundedqueue.BoundedQueue(queueSize, policy,
+                                               notify=self.wakeup.notify)
+
+        # With a window, packets are counted per talker and flow and only
+        # one summary per window goes on the queue
+        if window:
+            self.aggregator = aggregate.Aggregator(self.queue.put, window)
+        else:
+            self.aggregator = None
+
+        # Usual TTL of every source, learned from every record queued, so
+        # spoofed or rerouted traffic shows up against it (usualttl in
+        # display filters)
+        self.baseline = ttlbaseline.TTLBaseline()
+
+        # With lookup, the packet log shows host names, resolved in the
+        # background as rows come into view
+        if lookup:
+            self.resolver = resolver.Resolver(self.nameResolved, lookup)
+        else:
+            self.resolver = None
+
+        # Counters and latencies of every stage, shown by the GUI and, with
+        # statsFile, also written out as JSON every statsInterval seconds
+        self.stats = stats.PipelineStats(self.queue)
+        if statsFile:
+            self.dumper = stats.StatsDumper(self.stats, statsFile,
+                                            statsInterval)
+        else:
+            self.dumper = None
+
+        # With a store directory every record is also kept on disk for
+        # later queries, written by the store's own thread
+        if store:
+            self.store = capturestore.CaptureStore(store)
+        else:
+            self.store = None
+
+        # With export, a pcapexport.PcapExport, the raw frames are saved
+        # too. Only frames captured in this process can be, so not with
+        # workers or several sources.
+        self.export = export
+
+        # Open the capture socket up front so the GUI can refilter it.
+        # With workers, capture and decoding run in their own processes
+        # instead and only decoded records come back to this one. With
+        # replay, packets come from a pcap/pcapng file instead of the wire.
+        # Several interfaces, or one split with fanout, get a capture
+        # process each and are merged back in timestamp order. With ring,
+        # a single socket reads frames out of a memory-mapped ring.
+        ifaces = ifaces or [None]
+        if replay:
+            self.capture = pcapreplay.PcapReplay(replay, speed)
+        elif len(ifaces) > 1 or fanout > 1:
+            self.capture = multicapture.MultiCapture(ifaces, self.baseFilter,
+                                                     fanout)
+            self.capture.start()
+            self.stats.sources = self.capture.sourceStats
+        elif workers:
+            self.capture = pipeline.Pipeline(workers, ifaces[0],
+                                             self.baseFilter)
+            self.capture.start()
+        else:
+            self.capture = (ring and ringcapture.RingCapture or
+                            capture.LiveCapture)(ifaces[0], self.baseFilter)
+        startup.mark('capture')
 
         # Set up the GUI part
-        self.gui=GuiPart(self.queue, self.endApplication)
+        self.gui=GuiPart(self.queue, self.endApplication, self.setFilter,
+                         aggregate=bool(window), stats=self.stats, sets=sets,
+                         baseline=self.baseline,
+                         names=self.resolver and self.resolver.name)
         self.gui.show()
+        startup.mark('gui')
 
-        # A timer to periodically call periodicCall :-)
-        self.timer = qt.QTimer()
-        qt.QObject.connect(self.timer,
-                           qt.SIGNAL("timeout()"),
-                           self.periodicCall)
-        # Start the timer -- this replaces the initial call to periodicCall
-        self.timer.start(100)
+        # Instead of polling the queue on a timer, let the workers wake
+        # the GUI thread up through a socket whenever they queue something
+        self.notifier = qt.QSocketNotifier(self.wakeup.fileno(),
+                                           qt.QSocketNotifier.Read)
+        self.notifier.activated.connect(self.wakeupCall)
 
         # Set up the thread to do asynchronous I/O
         # More can be made if necessary
@@ -119,31 +492,142 @@ class ThreadedClient:
         self.thread1.start()
 
 
+    def wakeupCall(self, fd):
+        """
+        Called by the socket notifier when a worker has queued something.
+        """
+        self.wakeup.clear()
+        self.periodicCall()
+
     def periodicCall(self):
         """
-        Check every 100 ms if there is something new in the queue.
+        Process what is new in the queue.
         """
-        self.gui.processIncoming()
+        if self.gui.processIncoming():
+            # Backlog left over; come back as soon as the event loop has
+            # had a chance to repaint instead of waiting for a wakeup
+            qt.QTimer.singleShot(0, self.periodicCall)
         if not self.running:
-            root.quit()
+            qt.QCoreApplication.instance().quit()
+
+    def nameResolved(self, addr, name):
+        """ Called in a resolver thread; get the log redrawn. """
+        if name:
+            self.gui.namesChanged = True
+            self.wakeup.notify()
 
     def endApplication(self):
         print 'ENDING'
         self.running = 0
+        if self.resolver:
+            self.resolver.close()
+        self.wakeup.notify()
 
-    def testTTL(self, pkt):
+    def setFilter(self, expr):
+        """
+        Refilter the running capture on baseFilter and expr. A replayed
+        file has no kernel filter, and testTTL skips its non-IP frames
+        anyway, so there only an empty expression is accepted; the
+        display filter narrows down a replay instead.
+        """
+        expr = expr.strip()
+        if isinstance(self.capture, pcapreplay.PcapReplay):
+            self.capture.setFilter(expr)
+            return
+        if expr:
+            expr = '(%s) and (%s)' % (self.baseFilter, expr)
+        else:
+            expr = self.baseFilter
+        self.capture.setFilter(expr)
+
+    def testTTL(self, frame, ts=None):
+        """
+        Queue the source address and TTL of a raw IP frame. ts is when it
+        was captured, if the source knows, and goes into the export.
+        """
+        if self.export:
+            self.export.write(frame, ts)
+        st = self.stats
+        st.captured += 1
+        if st.captured & st.sampleMask:
+            started = None
+        else:
+            started = time.time()
         try:
-            if pkt.haslayer(IP):
-                ipsrc=pkt.getlayer(IP).src
-                ttl = str(pkt.ttl)
-                msg = '[+] Pkt Received From: '+ipsrc+' with TTL: '+ ttl + '\n'
-                self.queue.put(msg)
+            if self.dissect:
+                rec = self.testTTLDissect(self.layers[0](str(frame)))
+            else:
+                rec = decode.decodeFrame(frame)
+        except Exception:
+            # A frame the decoder chokes on must not end the capture, but
+            # it should not go unnoticed either
+            st.failed += 1
+            return
+        if rec is None:
+            st.ignored += 1
+            return
+        if started:
+            st.decodeTime.add(time.time() - started)
+        self.queueRecord(None, rec)
+
+    def ringBlock(self, ring, frames):
+        """
+        testTTL for a block of a RingCapture, with the kernel's timestamp
+        of every frame.
+        """
+        testTTL = self.testTTL
+        for ts, start, end in frames:
+            testTTL(buffer(ring, start, end - start), ts)
+
+    def pipelineRecord(self, ts, rec):
+        """
+        Queue a record decoded by the pipeline's workers. Capture and
+        decoding happened in other processes, so only the records that
+        made it here are counted.
+        """
+        self.stats.captured += 1
+        self.queueRecord(ts, rec)
 
-        except:
-            pass
+    def queueRecord(self, ts, rec):
+        """
+        Queue an already decoded record for the packet log, or count it
+        when aggregating. ts is the capture time, None for now.
+        """
+        now = time.time()
+        if self.baseline is not None:
+            self.baseline.add(rec[1], rec[4])
+        if self.store:
+            self.store.append(ts or now, rec)
+        if self.aggregator:
+            self.aggregator.add(rec, now)
+            self.stats.aggregated += 1
+            return
+        self.queue.put((ts or now, rec))
+
+    def testTTLDissect(self, pkt):
+        """
+        The record testTTL wants from a fully dissected scapy packet, or
+        None if it is not IP.
+        """
+        Ether, IP, IPv6 = self.layers
+        if pkt.haslayer(IP):
+            ip = pkt.getlayer(IP)
+            rec = (4, socket.inet_aton(ip.src), socket.inet_aton(ip.dst),
+                   ip.proto, ip.ttl, ip.len)
+        elif pkt.haslayer(IPv6):
+            ip = pkt.getlayer(IPv6)
+            rec = (6, socket.inet_pton(socket.AF_INET6, ip.src),
+                   socket.inet_pton(socket.AF_INET6, ip.dst),
+                   ip.nh, ip.hlim, ip.plen + 40)
+        else:
+            return None
+        return rec
 
     def stopperCheck(self):
-        print self.running
+        if self.aggregator:
+            self.aggregator.poll(time.time())
+        if self.export:
+            self.export.flush()
         if self.running:
             return False
         
@@ -159,10 +643,32 @@ class ThreadedClient:
         control.
         """
         try:
-            sniff(prn=self.testTTL, store=0, stopperTimeout=1, stopper=self.stopperCheck)
+            if isinstance(self.capture, (pipeline.Pipeline,
+                                         multicapture.MultiCapture)):
+                self.capture.run(self.pipelineRecord,
+                                 stopper=self.stopperCheck, timeout=1)
+                self.capture.stop()
+            elif isinstance(self.capture, ringcapture.RingCapture):
+                self.capture.runBlocks(self.ringBlock,
+                                       stopper=self.stopperCheck, timeout=1)
+            elif isinstance(self.capture, pcapreplay.PcapReplay):
+                # The file's own timestamps go into any export
+                self.capture.run(self.testTTL, stopper=self.stopperCheck,
+                                 timeout=1, stamped=True)
+            else:
+                self.capture.run(self.testTTL, stopper=self.stopperCheck,
+                                 timeout=1)
 
         except KeyboardInterrupt:
             exit(0)
+        finally:
+            if self.store:
+                self.store.close()
+            if self.dumper:
+                self.dumper.stop()
+            if self.export:
+                self.export.close()
+                print self.export.status()
 
 
         # while self.running:
@@ -179,8 +685,93 @@ class ThreadedClient:
 
 def main():
 
+    parser = optparse.OptionParser()
+    parser.add_option('--dissect', action='store_true', default=False,
+                      help='fully dissect every packet with scapy')
+    parser.add_option('-i', '--iface', action='append', dest='ifaces',
+                      help='interface to capture on; repeat for several')
+    parser.add_option('--fanout', type='int', default=1,
+                      help='split each interface over this many capture '
+                           'processes')
+    parser.add_option('--workers', type='int', default=0,
+                      help='capture and decode in this many processes')
+    parser.add_option('--ring', action='store_true', default=False,
+                      help='capture through a memory-mapped ring')
+    parser.add_option('--replay', metavar='FILE',
+                      help='replay a pcap/pcapng file instead of sniffing')
+    parser.add_option('--speed', type='float', default=1.0,
+                      help='replay speed, 1 is real time, 0 flat out')
+    parser.add_option('--window', type='float', default=0,
+                      help='show talker/flow tables updated every WINDOW '
+                           'seconds instead of a line per packet')
+    parser.add_option('--queue-size', type='int', default=10000,
+                      help='most messages waiting for the GUI')
+    parser.add_option('--policy', choices=boundedqueue.POLICIES,
+                      default=boundedqueue.DROP_NEWEST,
+                      help='what to do when the GUI queue is full: '
+                           + ', '.join(boundedqueue.POLICIES))
+    parser.add_option('--store', metavar='DIR',
+                      help='also record every packet in a capture store')
+    parser.add_option('--stats-file', metavar='FILE',
+                      help='write pipeline stats to FILE as JSON')
+    parser.add_option('--stats-interval', type='float', default=5.0,
+                      help='seconds between stats dumps')
+    parser.add_option('--export', metavar='PREFIX',
+                      help='also save the captured frames, as passed by '
+                           'the capture filter, to files named PREFIX-*')
+    parser.add_option('--export-format', choices=pcapexport.FORMATS,
+                      default='pcap', help='pcap or pcapng')
+    parser.add_option('--rotate-size', type='int', default=1024,
+                      metavar='MB', help='start a new export file after '
+                                         'this many megabytes')
+    parser.add_option('--rotate-time', type='int', default=3600,
+                      metavar='SECONDS', help='start a new export file '
+                                              'after this many seconds')
+    parser.add_option('--keep', type='int', default=0,
+                      help='keep only this many export files, 0 for all')
+    parser.add_option('--resolve', action='store_true', default=False,
+                      help='show host names, from reverse DNS')
+    parser.add_option('--hosts', metavar='FILE',
+                      help='show host names, from a hosts file')
+    parser.add_option('--set', action='append', default=[],
+                      metavar='NAME=FILE',
+                      help='address set for display filters as $NAME, '
+                           'one address or CIDR prefix per line of FILE')
+    opts, args = parser.parse_args()
+    if opts.fanout > 1 and not opts.ifaces:
+        parser.error('--fanout needs --iface')
+    if opts.export and (opts.workers or opts.fanout > 1 or
+                        len(opts.ifaces or []) > 1):
+        parser.error('--export needs a single capture process')
+    sets = {}
+    for spec in opts.set:
+        name, sep, path = spec.partition('=')
+        if not sep:
+            parser.error('--set needs NAME=FILE')
+        try:
+            sets[name] = displayfilter.readAddressSet(path)
+        except (IOError, FilterError) as e:
+            parser.error('--set %s: %s' % (spec, e))
+    lookup = None
+    if opts.hosts:
+        try:
+            lookup = resolver.hostsLookup(opts.hosts)
+        except IOError as e:
+            parser.error('--hosts: %s' % e)
+    elif opts.resolve:
+        lookup = resolver.systemLookup
+
+    export = opts.export and pcapexport.PcapExport(
+        opts.export, opts.export_format, rotateBytes=opts.rotate_size << 20,
+        rotateSeconds=opts.rotate_time, keep=opts.keep)
+
     root = QtGui.QApplication(sys.argv)
-    client = ThreadedClient()
+    startup.mark('qt')
+    client = ThreadedClient(opts.dissect, opts.workers, opts.replay,
+                            opts.speed, opts.window, opts.queue_size,
+                            opts.policy, opts.store, opts.stats_file,
+                            opts.stats_interval, opts.ifaces, opts.fanout,
+                            sets, lookup, opts.ring, export)
     sys.exit(root.exec_())
 
 
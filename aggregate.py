@@ -0,0 +1,74 @@
+"""
+Windowed per-talker and per-flow aggregation between capture and the GUI.
+
+Rather than one message per packet, the Aggregator counts packets and
+bytes per (source, TTL) and per (source, destination, protocol) flow, and
+once per window emits a single Delta holding only what was seen during
+that window. The GUI adds the deltas into its tables, so the queue carries
+one small object per window whatever the packet rate.
+"""
+
+
+class Delta:
+    """
+    Counters for one window. talkers maps (src, ttl) and flows maps
+    (src, dst, proto) to [packets, bytes], with packed addresses as in
+    decode records.
+    """
+    def __init__(self, start, end, talkers, flows):
+        self.start = start
+        self.end = end
+        self.talkers = talkers
+        self.flows = flows
+
+
+class Aggregator:
+    """
+    Counts decoded records over windows of window seconds and calls
+    emit(delta) at the end of every window that saw any traffic.
+
+    add and poll must be called from the same thread, normally the
+    capture thread; poll lets an idle capture loop close the window.
+    """
+    def __init__(self, emit, window=1.0):
+        self.emit = emit
+        self.window = window
+        self.start = None
+        self.end = None
+        self.talkers = {}
+        self.flows = {}
+
+    def add(self, rec, now):
+        if self.end is None:
+            self.start, self.end = now, now + self.window
+        elif now >= self.end:
+            self.flush(now)
+        version, src, dst, proto, ttl, length = rec
+
+        c = self.talkers.get((src, ttl))
+        if c is None:
+            self.talkers[(src, ttl)] = [1, length]
+        else:
+            c[0] += 1
+            c[1] += length
+
+        c = self.flows.get((src, dst, proto))
+        if c is None:
+            self.flows[(src, dst, proto)] = [1, length]
+        else:
+            c[0] += 1
+            c[1] += length
+
+    def poll(self, now):
+        """ Close the current window if it has run out. """
+        if self.end is not None and now >= self.end:
+            self.flush(now)
+
+    def flush(self, now):
+        """ Emit the current window, if it saw anything, and start a new one. """
+        if self.talkers:
+            self.emit(Delta(self.start, min(now, self.end), self.talkers,
+                            self.flows))
+            self.talkers = {}
+            self.flows = {}
+        self.start, self.end = now, now + self.window
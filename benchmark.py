@@ -0,0 +1,296 @@
+#!/usr/bin/python
+
+"""
+Headless throughput and latency benchmark for the
+capture -> testTTL -> queue -> processIncoming path.
+
+No display is needed. The GUI classes of Threadtest2.py (Qt) and
+recipe-82965-1.py (Tk) are subclassed with their widget setup replaced by
+stubs, and the GUI event loop is replaced by a loop that waits on the same
+socket wakeup as the GUIs (or polls at --interval) and then calls
+processIncoming. A producer thread feeds synthetic Ethernet/IPv4 frames at a
+given rate and size through the real testTTL and processIncoming code.
+
+Reported per variant: sustained rendered packets/sec, enqueue-to-render
+latency percentiles, queue depth over time and the frames that never
+made it to the screen.
+
+    ./benchmark.py --variant qt --rate 20000 --size 128 --duration 10
+"""
+
+import collections, imp, json, optparse, os, select, socket, struct
+import sys, threading, time
+
+import boundedqueue, decode, packetlog, stats, wakeup
+
+
+class TimedQueue(boundedqueue.BoundedQueue):
+    """
+    BoundedQueue that remembers when every item was put. Items come out in
+    FIFO order, so the put times of the items handed out since the last
+    call to takeTimes are simply the head of that record.
+    """
+    def _init(self, maxsize):
+        boundedqueue.BoundedQueue._init(self, maxsize)
+        self.putTimes = collections.deque()
+        self.gotTimes = []
+        self.puts = 0
+
+    def _put(self, item):
+        boundedqueue.BoundedQueue._put(self, item)
+        self.putTimes.append(time.time())
+        self.puts += 1
+
+    def _get(self):
+        self.gotTimes.append(self.putTimes.popleft())
+        return boundedqueue.BoundedQueue._get(self)
+
+    def _drop(self):
+        # Not handed out, so no latency to record
+        boundedqueue.BoundedQueue._drop(self)
+        self.gotTimes.pop()
+
+    def takeTimes(self):
+        self.mutex.acquire()
+        try:
+            times, self.gotTimes = self.gotTimes, []
+        finally:
+            self.mutex.release()
+        return times
+
+
+class StubLabel:
+    """ Stands in for the status QLabel or Tkinter.Label. """
+    def setText(self, text):
+        self.text = text
+
+    def config(self, text):
+        self.text = text
+
+
+class StubLog:
+    """ Stands in for the packet log view; keeps the records in a ring. """
+    def __init__(self):
+        self.ring = packetlog.PacketRing()
+        self.appends = 0
+
+    def append(self, records):
+        self.ring.extend(records)
+        self.appends += 1
+
+
+def syntheticFrames(size, count=256):
+    """ A set of Ethernet/IPv4 frames of size bytes from varying sources. """
+    frames = []
+    size = max(size, 34)
+    for i in range(count):
+        src = socket.inet_aton('10.0.%d.%d' % (i >> 8, i & 0xff))
+        ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, size - 14, 0, 0,
+                         32 + i % 96, 17, 0, src, socket.inet_aton('10.1.0.1'))
+        frames.append('\xff' * 12 + '\x08\x00' + ip + '\0' * (size - 34))
+    return frames
+
+
+def qtVariant(queue):
+    """
+    Threadtest2's ThreadedClient.testTTL and GuiPart.processIncoming with
+    the widgets stubbed out. Returns (sink, tick) where tick returns True
+    when there is backlog left.
+    """
+    import Threadtest2
+    pipelineStats = stats.PipelineStats(queue)
+
+    # The stubs set only what the real __init__ gets from outside; the
+    # rest of the state comes from the class defaults the real code has
+    class BareGui(Threadtest2.GuiPart):
+        def __init__(self, queue):
+            self.queue = queue
+            self.appendLog = StubLog().append
+            self.status = StubLabel()
+            self.stats = pipelineStats
+
+    class BareClient(Threadtest2.ThreadedClient):
+        def __init__(self, queue):
+            self.queue = queue
+            self.dissect = False
+            self.aggregator = None
+            self.store = None
+            self.stats = pipelineStats
+
+    gui = BareGui(queue)
+    return BareClient(queue).testTTL, gui.processIncoming
+
+
+def tkVariant(queue):
+    """
+    recipe-82965-1's GuiPart.processIncoming, which prints every message,
+    with stdout pointed at /dev/null while it runs.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    recipe = imp.load_source('recipe', os.path.join(here, 'recipe-82965-1.py'))
+
+    class BareGui(recipe.GuiPart):
+        def __init__(self, queue):
+            self.queue = queue
+            self.status = StubLabel()
+
+    gui = BareGui(queue)
+    devnull = open(os.devnull, 'w')
+
+    def sink(frame):
+        rec = decode.decodeFrame(frame)
+        if rec is not None:
+            queue.put('[+] Pkt Received From: %s with TTL: %d' % (
+                decode.formatAddr(rec[1]), rec[4]))
+
+    def tick():
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            gui.processIncoming()
+        finally:
+            sys.stdout = stdout
+        return False
+
+    return sink, tick
+
+
+VARIANTS = {'qt': qtVariant, 'tk': tkVariant}
+
+
+def producer(sink, frames, rate, deadline, counts):
+    """
+    Offer frames to sink at rate frames/sec (0 for as fast as possible)
+    until deadline, in 1 ms slices.
+    """
+    nframes = len(frames)
+    start = time.time()
+    sent = 0
+    while True:
+        now = time.time()
+        if now >= deadline:
+            break
+        if rate:
+            due = int((now - start) * rate)
+            if due <= sent:
+                time.sleep(0.001)
+                continue
+        else:
+            due = sent + 1000
+        while sent < due:
+            sink(frames[sent % nframes])
+            sent += 1
+    counts['offered'] = sent
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def runVariant(name, rate, size, duration, interval, queueSize, policy):
+    wake = wakeup.Wakeup()
+    queue = TimedQueue(queueSize, policy,
+                       notify=not interval and wake.notify or None)
+    sink, tick = VARIANTS[name](queue)
+    frames = syntheticFrames(size)
+
+    counts = {}
+    deadline = time.time() + duration
+    thread = threading.Thread(target=producer,
+                              args=(sink, frames, rate, deadline, counts))
+    start = time.time()
+    thread.start()
+
+    latencies = []
+    depth = []
+    rendered = 0
+    nextSample = start
+    while thread.isAlive() or queue.qsize():
+        wake.clear()
+        pending = queue.qsize()
+        backlog = tick()
+        now = time.time()
+        times = queue.takeTimes()
+        rendered += len(times)
+        latencies.extend(now - t for t in times)
+        if now >= nextSample:
+            depth.append((round(now - start, 2), pending))
+            nextSample = now + 0.5
+        if backlog:
+            continue
+        if interval:
+            time.sleep(interval)
+        else:
+            # The timeout is only there to notice the producer finishing
+            select.select([wake], [], [], 0.1)
+    elapsed = time.time() - start
+    thread.join()
+
+    latencies.sort()
+    return {
+        'variant': name,
+        'rate': rate,
+        'size': size,
+        'offered': counts['offered'],
+        'enqueued': queue.puts,
+        'rendered': rendered,
+        'dropped': counts['offered'] - rendered,
+        'queue_dropped': queue.dropped,
+        'queue_sampled_out': queue.sampledOut,
+        'pps': rendered / elapsed,
+        'latency_ms': dict(('p%g' % p, 1000 * percentile(latencies, p))
+                           for p in (50, 90, 99, 99.9)),
+        'latency_max_ms': 1000 * (latencies and latencies[-1] or 0),
+        'depth_max': max(d for t, d in depth),
+        'depth': depth,
+    }
+
+
+def report(result):
+    print '%(variant)s: %(rate)d pps offered, %(size)d byte frames' % result
+    print '  rendered %(rendered)d of %(offered)d, dropped %(dropped)d ' \
+          '(queue: %(queue_dropped)d dropped, %(queue_sampled_out)d ' \
+          'sampled out)' % result
+    print '  sustained %.0f pkts/sec' % result['pps']
+    print '  latency ms: ' + ', '.join('%s %.1f' % (k, result['latency_ms'][k])
+        for k in sorted(result['latency_ms'], key=lambda k: float(k[1:]))) + \
+        ', max %.1f' % result['latency_max_ms']
+    print '  queue depth: max %d, samples %s' % (result['depth_max'],
+        ' '.join('%d' % d for t, d in result['depth']))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--variant', choices=['qt', 'tk', 'both'],
+                      default='both')
+    parser.add_option('--rate', type='int', default=10000,
+                      help='offered packets/sec, 0 for as fast as possible')
+    parser.add_option('--size', type='int', default=128,
+                      help='frame size in bytes')
+    parser.add_option('--duration', type='float', default=5.0)
+    parser.add_option('--interval', type='float', default=0,
+                      help='poll the queue every INTERVAL ms like the old '
+                           'GUI timer instead of waiting for wakeups')
+    parser.add_option('--queue-size', type='int', default=100000)
+    parser.add_option('--policy', choices=boundedqueue.POLICIES,
+                      default=boundedqueue.DROP_NEWEST)
+    parser.add_option('--json', metavar='FILE',
+                      help='also write the results to FILE')
+    opts, args = parser.parse_args()
+
+    variants = opts.variant == 'both' and ['qt', 'tk'] or [opts.variant]
+    results = []
+    for name in variants:
+        result = runVariant(name, opts.rate, opts.size, opts.duration,
+                            opts.interval / 1000.0, opts.queue_size,
+                            opts.policy)
+        report(result)
+        results.append(result)
+
+    if opts.json:
+        json.dump(results, open(opts.json, 'w'), indent=2)
+
+
+if __name__ == '__main__':
+    main()
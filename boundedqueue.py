@@ -0,0 +1,128 @@
+"""
+Bounded GUI queue with an explicit overload policy.
+
+BoundedQueue is a drop-in Queue.Queue whose storage is a ring of maxsize
+slots allocated up front, so memory stays flat however far the GUI falls
+behind. put never raises Queue.Full; when the queue is full it applies
+one of the policies below and counts what it threw away:
+
+    DROP_NEWEST   refuse the new item
+    DROP_OLDEST   discard the oldest queued item to make room
+    BLOCK         wait up to timeout seconds for room, then refuse
+    SAMPLE        once the queue is half full, accept only 1 in N items,
+                  with N doubling for every further 5% of fill (up to
+                  1024); refuse what still does not fit
+
+dropped, sampledOut and sampleEvery are plain attributes for the GUI to
+show. If notify is given it is called after every successful put, outside
+the queue lock, e.g. to wake the GUI thread.
+"""
+
+import Queue, time
+
+DROP_NEWEST = 'drop-newest'
+DROP_OLDEST = 'drop-oldest'
+BLOCK = 'block'
+SAMPLE = 'sample'
+
+POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK, SAMPLE)
+
+
+class BoundedQueue(Queue.Queue):
+
+    def __init__(self, maxsize=10000, policy=DROP_NEWEST, timeout=0.1,
+                 notify=None):
+        if maxsize <= 0:
+            raise ValueError('BoundedQueue needs a positive maxsize')
+        if policy not in POLICIES:
+            raise ValueError('unknown overload policy %r' % policy)
+        self.policy = policy
+        self.timeout = timeout
+        self.notify = notify
+        self.offered = 0
+        self.dropped = 0
+        self.sampledOut = 0
+        self.sampleEvery = 1
+        Queue.Queue.__init__(self, maxsize)
+
+    # Ring storage, called by Queue.Queue with the mutex held
+
+    def _init(self, maxsize):
+        self.ring = [None] * maxsize
+        self.head = 0
+        self.count = 0
+
+    def _qsize(self, len=len):
+        return self.count
+
+    def _put(self, item):
+        self.ring[(self.head + self.count) % self.maxsize] = item
+        self.count += 1
+
+    def _get(self):
+        item = self.ring[self.head]
+        self.ring[self.head] = None
+        self.head = (self.head + 1) % self.maxsize
+        self.count -= 1
+        return item
+
+    def _drop(self):
+        """ Discard the oldest item to make room for a new one. """
+        self._get()
+        self.unfinished_tasks -= 1
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Queue item, applying the overload policy if there is no room.
+        Returns True if item was queued. block and timeout are accepted
+        for compatibility with Queue.Queue; the policy decides.
+        """
+        self.not_full.acquire()
+        try:
+            self.offered += 1
+            if self.policy == SAMPLE:
+                fill = float(self.count) / self.maxsize
+                if fill < 0.5:
+                    self.sampleEvery = 1
+                else:
+                    self.sampleEvery = 2 ** min(int((fill - 0.5) * 20) + 1, 10)
+                    if self.offered % self.sampleEvery:
+                        self.sampledOut += 1
+                        return False
+
+            if self.count >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    self._drop()
+                    self.dropped += 1
+                elif self.policy == BLOCK:
+                    endtime = time.time() + self.timeout
+                    while self.count >= self.maxsize:
+                        remaining = endtime - time.time()
+                        if remaining <= 0:
+                            self.dropped += 1
+                            return False
+                        self.not_full.wait(remaining)
+                else:
+                    self.dropped += 1
+                    return False
+
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+        finally:
+            self.not_full.release()
+        if self.notify:
+            self.notify()
+        return True
+
+    def put_nowait(self, item):
+        return self.put(item, False)
+
+    def status(self):
+        """ One line summary of the overload counters for the GUI. """
+        text = 'Queued %d/%d, dropped %d' % (self.count, self.maxsize,
+                                             self.dropped)
+        if self.policy == SAMPLE:
+            text += ', sampling 1 in %d (%d skipped)' % (self.sampleEvery,
+                                                       self.sampledOut)
+        return text
@@ -0,0 +1,114 @@
+"""
+Kernel-side packet filtering for the capture sockets.
+
+Filter expressions use the usual tcpdump/libpcap syntax. They are compiled
+into a classic BPF program, with libpcap if it can be loaded and with
+'tcpdump -ddd' otherwise, and attached to the socket with SO_ATTACH_FILTER.
+Frames the program rejects are dropped by the kernel and never reach
+Python. Attaching a new program atomically replaces the old one, so the
+filter can be changed while a capture loop is blocked on the socket.
+"""
+
+import ctypes, ctypes.util, socket, subprocess
+
+SO_ATTACH_FILTER = 26
+SO_DETACH_FILTER = 27
+
+DLT_EN10MB = 1
+
+
+class FilterError(Exception):
+    """ Raised when a filter expression does not compile. """
+    pass
+
+
+class SockFilter(ctypes.Structure):
+    # struct sock_filter, identical in layout to libpcap's struct bpf_insn
+    _fields_ = [('code', ctypes.c_ushort),
+                ('jt', ctypes.c_ubyte),
+                ('jf', ctypes.c_ubyte),
+                ('k', ctypes.c_uint32)]
+
+
+class SockFprog(ctypes.Structure):
+    _fields_ = [('len', ctypes.c_ushort),
+                ('filter', ctypes.POINTER(SockFilter))]
+
+
+class BpfProgram(ctypes.Structure):
+    _fields_ = [('bf_len', ctypes.c_uint),
+                ('bf_insns', ctypes.POINTER(SockFilter))]
+
+
+_libpcap = None
+
+def _loadLibpcap():
+    global _libpcap
+    if _libpcap is None:
+        name = ctypes.util.find_library('pcap')
+        _libpcap = name and ctypes.CDLL(name) or False
+        if _libpcap:
+            _libpcap.pcap_open_dead.restype = ctypes.c_void_p
+            _libpcap.pcap_geterr.restype = ctypes.c_char_p
+    return _libpcap
+
+
+def _compileLibpcap(lib, expr, snaplen):
+    pcap = lib.pcap_open_dead(DLT_EN10MB, snaplen)
+    prog = BpfProgram()
+    try:
+        if lib.pcap_compile(ctypes.c_void_p(pcap), ctypes.byref(prog),
+                            expr, 1, 0xffffffff) < 0:
+            raise FilterError(lib.pcap_geterr(ctypes.c_void_p(pcap)))
+        insns = [(i.code, i.jt, i.jf, i.k)
+                 for i in prog.bf_insns[:prog.bf_len]]
+        lib.pcap_freecode(ctypes.byref(prog))
+        return insns
+    finally:
+        lib.pcap_close(ctypes.c_void_p(pcap))
+
+
+def _compileTcpdump(expr, snaplen):
+    try:
+        p = subprocess.Popen(['tcpdump', '-y', 'EN10MB', '-ddd',
+                              '-s', str(snaplen), expr],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise FilterError('neither libpcap nor tcpdump available: %s' % e)
+    out, err = p.communicate()
+    if p.returncode:
+        raise FilterError(err.strip())
+    words = [int(w) for w in out.split()]
+    return [tuple(words[i:i+4]) for i in range(1, 4*words[0] + 1, 4)]
+
+
+def compileFilter(expr, snaplen=65535):
+    """
+    Compile a tcpdump-style filter expression for Ethernet frames and
+    return the BPF program as a list of (code, jt, jf, k) tuples.
+    """
+    lib = _loadLibpcap()
+    if lib:
+        return _compileLibpcap(lib, expr, snaplen)
+    return _compileTcpdump(expr, snaplen)
+
+
+def attachFilter(sock, expr, snaplen=65535):
+    """ Compile expr and attach it to sock, replacing any earlier filter. """
+    insns = compileFilter(expr, snaplen)
+    prog = (SockFilter * len(insns))(*insns)
+    fprog = SockFprog(len(insns), prog)
+    # The kernel copies the program during setsockopt, so prog only has to
+    # stay alive until the call returns
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER,
+                    ctypes.string_at(ctypes.addressof(fprog),
+                                     ctypes.sizeof(fprog)))
+
+
+def detachFilter(sock):
+    """ Remove the filter from sock, if it has one. """
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_DETACH_FILTER, 0)
+    except socket.error:
+        # ENOENT: nothing attached
+        pass
@@ -0,0 +1,132 @@
+"""
+Dirty-tracked, frame-rate capped rendering for Tk canvas items.
+
+Anything that wants an item to look different, from any thread, calls
+set or flash on the CanvasRenderer. Nothing touches the canvas there;
+the change is only recorded, and recorded changes to the same item are
+merged. At most fps times a second the Tk thread applies what actually
+changed since the last frame, one itemconfig per changed item, so the
+cost of drawing follows the number of changes and not the packet rate.
+When nothing changes no frames are run at all.
+"""
+
+import threading, time
+import Tkinter as tk
+
+import wakeup
+
+
+class CanvasRenderer:
+
+    def __init__(self, canvas, fps=30):
+        self.canvas = canvas
+        self.interval = 1.0 / fps
+        self.lock = threading.Lock()
+        # item -> {option: value}, as last applied to the canvas
+        self.current = {}
+        # item -> {option: value}, to be applied on the next frame
+        self.dirty = {}
+        # (item, option) -> (due time, value to go back to) for flashes
+        self.reverts = {}
+        self.scheduled = False
+        self.lastFrame = 0
+        self.frames = 0
+        self.changes = 0
+        self.wakeup = wakeup.Wakeup()
+        canvas.tk.createfilehandler(self.wakeup.fileno(), tk.READABLE,
+                                    self.wakeupCall)
+
+    def track(self, item, **options):
+        """
+        Tell the renderer the current options of an item that was just
+        created. Must be called from the Tk thread. flash needs to know
+        what it is reverting to.
+        """
+        self.current.setdefault(item, {}).update(options)
+
+    def set(self, item, **options):
+        """ Change options of item on the next frame. Thread-safe. """
+        self.lock.acquire()
+        try:
+            self._set(item, options)
+        finally:
+            self.lock.release()
+        self.wakeup.notify()
+
+    def flash(self, item, option, value, duration):
+        """
+        Set option of item to value for duration seconds, then put it back.
+        Flashing an item that is already flashing just extends the flash.
+        Thread-safe.
+        """
+        self.lock.acquire()
+        try:
+            key = (item, option)
+            revert = self.reverts.pop(key, None)
+            if revert is not None:
+                base = revert[1]
+            else:
+                base = self.dirty.get(item, {}).get(
+                    option, self.current.get(item, {}).get(option))
+            self._set(item, {option: value})
+            if base is not None:
+                self.reverts[key] = (time.time() + duration, base)
+        finally:
+            self.lock.release()
+        self.wakeup.notify()
+
+    def _set(self, item, options):
+        current = self.current.get(item, {})
+        for option, value in options.iteritems():
+            if (item, option) in self.reverts:
+                # Mid-flash: this becomes the value the flash reverts to
+                due, base = self.reverts[(item, option)]
+                self.reverts[(item, option)] = (due, value)
+                continue
+            pending = self.dirty.get(item)
+            if pending is not None and option in pending:
+                pending[option] = value
+            elif current.get(option) != value:
+                self.dirty.setdefault(item, {})[option] = value
+
+    def wakeupCall(self, fd, mask):
+        self.wakeup.clear()
+        self.schedule(0)
+
+    def schedule(self, delay):
+        """ Run a frame after delay seconds, but not sooner than fps allows. """
+        if self.scheduled:
+            return
+        delay = max(delay, self.lastFrame + self.interval - time.time(), 0)
+        self.scheduled = True
+        self.canvas.after(int(delay * 1000), self.frame)
+
+    def frame(self):
+        """ Apply everything that changed since the last frame. """
+        self.scheduled = False
+        now = time.time()
+        self.lock.acquire()
+        try:
+            for key, (due, base) in self.reverts.items():
+                if due <= now:
+                    del self.reverts[key]
+                    self._set(key[0], {key[1]: base})
+            dirty, self.dirty = self.dirty, {}
+            # Count these as applied already, so a set arriving while they
+            # are being drawn compares against what will be on screen
+            for item, options in dirty.iteritems():
+                self.current.setdefault(item, {}).update(options)
+            nextDue = self.reverts and min(due for due, base
+                                           in self.reverts.itervalues())
+        finally:
+            self.lock.release()
+
+        itemconfig = self.canvas.itemconfig
+        for item, options in dirty.iteritems():
+            itemconfig(item, **options)
+        self.changes += len(dirty)
+        self.frames += 1
+        self.lastFrame = now
+
+        if nextDue:
+            self.schedule(nextDue - now)
@@ -0,0 +1,82 @@
+"""
+Packet sources for the capture threads.
+
+A source owns its capture socket and runs a loop that hands every frame
+to a callback until a stopper says otherwise, much like scapy's sniff().
+Owning the socket is what lets us change the kernel filter on the fly.
+"""
+
+import select, socket, time
+
+import bpf
+
+ETH_P_ALL = 0x0003
+SOL_PACKET = 263
+PACKET_FANOUT = 18
+FANOUT_HASH, FANOUT_LB, FANOUT_CPU = 0, 1, 2
+
+
+class LiveCapture:
+    """
+    Live capture of raw Ethernet frames on an AF_PACKET socket.
+
+    setFilter may be called from any thread, e.g. the GUI thread, while
+    run is busy in the capture thread; the new BPF program takes effect
+    on the next frame the kernel sees.
+    """
+    def __init__(self, iface=None, filter=None, snaplen=65535):
+        self.iface = iface
+        self.snaplen = snaplen
+        self.filter = None
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW,
+                                  socket.htons(ETH_P_ALL))
+        if iface:
+            self.sock.bind((iface, ETH_P_ALL))
+        if filter:
+            self.setFilter(filter)
+
+    def setFilter(self, expr):
+        """
+        Replace the kernel filter with expr. An empty expression removes
+        the filter. Raises bpf.FilterError and keeps the old filter if
+        expr does not compile.
+        """
+        expr = expr and expr.strip()
+        if expr:
+            bpf.attachFilter(self.sock, expr, self.snaplen)
+        else:
+            bpf.detachFilter(self.sock)
+        self.filter = expr or None
+
+    def joinFanout(self, group, mode=FANOUT_HASH):
+        """
+        Join fanout group, whose sockets share the interface's traffic
+        instead of each seeing all of it: the kernel hands every frame to
+        just one of them, chosen by flow hash, round robin or receiving
+        CPU (i.e. RSS queue) depending on mode. The socket must be bound
+        to an interface.
+        """
+        self.sock.setsockopt(SOL_PACKET, PACKET_FANOUT,
+                             (group & 0xffff) | (mode << 16))
+
+    def run(self, prn, stopper=None, timeout=1):
+        """
+        Call prn(frame) with the raw bytes of every frame that passes the
+        filter. stopper is checked at least every timeout seconds, busy
+        or idle, and the loop returns as soon as it returns True.
+        """
+        sock = self.sock
+        snaplen = self.snaplen
+        checkAt = time.time() + timeout
+        while True:
+            ready, _, _ = select.select([sock], [], [], timeout)
+            if ready:
+                prn(sock.recv(snaplen))
+                if time.time() < checkAt:
+                    continue
+            if stopper and stopper():
+                return
+            checkAt = time.time() + timeout
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,332 @@
+#!/usr/bin/python
+
+"""
+Append-only columnar store for decoded packet records.
+
+A store is a directory with one file per record field (ts.col,
+version.col, src.col, dst.col, proto.col, ttl.col, length.col), each a
+flat array of fixed-size values, plus a sparse time index with one entry
+per chunk: its first row, its row count and the lowest and highest
+timestamp in it.
+
+CaptureStore is the writer. append only adds the record to an in-memory
+batch; a background thread turns every full batch (or whatever is there
+every flushInterval seconds) into arrays, appends each column in one
+write and then the chunk's index entry. The capture thread never waits on
+the disk: when the writer is more than maxPending chunks behind, records
+are dropped and counted instead. Rows only count once their index entry
+is written, so a crash loses at most the chunks in flight.
+
+StoreReader memory-maps the columns and answers queries with NumPy: the
+index narrows a time range down to the chunks that can hold it, and the
+other conditions are vectorized comparisons over just those rows.
+
+    reader = StoreReader('capture')
+    hits = reader.query(start=time.time() - 3600, src='10.0.0.1', maxTTL=4)
+
+Run as a script to query a store from the command line.
+"""
+
+import os, Queue, socket, sys, threading, time
+from optparse import OptionParser
+
+import numpy
+
+import decode
+
+COLUMNS = [('ts', 'f8'), ('version', 'u1'), ('src', 'S16'), ('dst', 'S16'),
+           ('proto', 'u1'), ('ttl', 'u1'), ('length', 'u4')]
+DTYPE = numpy.dtype(COLUMNS)
+INDEX = numpy.dtype([('first', 'u8'), ('count', 'u4'), ('tsMin', 'f8'),
+                     ('tsMax', 'f8')])
+
+
+def _readIndex(path):
+    name = os.path.join(path, 'index')
+    if not os.path.exists(name):
+        return numpy.zeros(0, INDEX)
+    data = open(name, 'rb').read()
+    # A torn last entry from a crash is ignored
+    return numpy.frombuffer(data[:len(data) - len(data) % INDEX.itemsize],
+                            INDEX)
+
+
+def _committed(index):
+    if not len(index):
+        return 0
+    return int(index['first'][-1] + index['count'][-1])
+
+
+def _checkColumns(path, rows):
+    """
+    Raise ValueError if a column holds fewer rows than the index, as do
+    stores from before length.col was widened to 4 bytes.
+    """
+    for name, kind in COLUMNS:
+        col = os.path.join(path, name + '.col')
+        size = rows * numpy.dtype(kind).itemsize
+        if rows and (not os.path.exists(col) or
+                     os.path.getsize(col) < size):
+            raise ValueError('%s: %s is shorter than its index; written by '
+                             'an older version?' % (path, name + '.col'))
+
+
+def parseAddr(addr):
+    """ Packed form of a printable IPv4 or IPv6 address. """
+    if ':' in addr:
+        return socket.inet_pton(socket.AF_INET6, addr)
+    return socket.inet_aton(addr)
+
+
+class CaptureStore:
+
+    def __init__(self, path, chunkRecords=65536, flushInterval=1.0,
+                 maxPending=64):
+        self.path = path
+        self.chunkRecords = chunkRecords
+        self.flushInterval = flushInterval
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        # Cut the columns back to what the index vouches for, in case the
+        # last writer died between writing a chunk and indexing it
+        self.rows = _committed(_readIndex(path))
+        _checkColumns(path, self.rows)
+        self.files = {}
+        for name, kind in COLUMNS:
+            f = open(os.path.join(path, name + '.col'), 'ab')
+            f.truncate(self.rows * numpy.dtype(kind).itemsize)
+            self.files[name] = f
+        self.index = open(os.path.join(path, 'index'), 'ab')
+        self.index.truncate(len(_readIndex(path)) * INDEX.itemsize)
+
+        self.lock = threading.Lock()
+        self.batch = []
+        self.chunks = Queue.Queue(maxPending)
+        self.appended = 0
+        self.dropped = 0
+        self.written = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.writer)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def append(self, ts, rec):
+        """
+        Queue one record for writing. Never blocks on the disk; returns
+        False if the record was dropped because the writer is behind.
+        """
+        self.lock.acquire()
+        try:
+            self.batch.append((ts,) + tuple(rec))
+            self.appended += 1
+            if len(self.batch) < self.chunkRecords:
+                return True
+            batch, self.batch = self.batch, []
+        finally:
+            self.lock.release()
+        return self._hand(batch)
+
+    def _hand(self, batch):
+        try:
+            self.chunks.put_nowait(batch)
+        except Queue.Full:
+            self.dropped += len(batch)
+            return False
+        return True
+
+    def writer(self):
+        while True:
+            try:
+                batch = self.chunks.get(timeout=self.flushInterval)
+            except Queue.Empty:
+                if not self.running:
+                    break
+                # Quiet spell: write out the partial batch
+                self.lock.acquire()
+                try:
+                    batch, self.batch = self.batch, []
+                finally:
+                    self.lock.release()
+            if batch is None:
+                break
+            if batch:
+                self.writeChunk(batch)
+        for f in self.files.itervalues():
+            f.close()
+        self.index.close()
+
+    def writeChunk(self, batch):
+        chunk = numpy.array(batch, DTYPE)
+        for name, kind in COLUMNS:
+            f = self.files[name]
+            f.write(chunk[name].tobytes())
+            f.flush()
+        entry = numpy.array([(self.rows, len(chunk), chunk['ts'].min(),
+                              chunk['ts'].max())], INDEX)
+        self.index.write(entry.tobytes())
+        self.index.flush()
+        self.rows += len(chunk)
+        self.written += len(chunk)
+
+    def close(self):
+        """ Write out everything appended so far and stop the writer. """
+        self.lock.acquire()
+        try:
+            batch, self.batch = self.batch, []
+        finally:
+            self.lock.release()
+        if batch:
+            # Closing is the one time it is fine to wait for the disk
+            self.chunks.put(batch)
+        self.running = False
+        self.chunks.put(None)
+        self.thread.join()
+
+    def status(self):
+        return 'Stored %d, dropped %d' % (self.written, self.dropped)
+
+
+class StoreReader:
+    """
+    Memory-mapped read access to a store, which may still be written to;
+    refresh picks up chunks written since.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.rows = -1
+        self.refresh()
+
+    def refresh(self):
+        self.index = _readIndex(self.path)
+        rows = _committed(self.index)
+        if rows == self.rows:
+            return
+        _checkColumns(self.path, rows)
+        self.rows = rows
+        self.columns = {}
+        for name, kind in COLUMNS:
+            if rows:
+                self.columns[name] = numpy.memmap(
+                    os.path.join(self.path, name + '.col'), kind, 'r',
+                    shape=(rows,))
+            else:
+                self.columns[name] = numpy.zeros(0, kind)
+
+    def __len__(self):
+        return self.rows
+
+    def rowRanges(self, start=None, end=None):
+        """ (first, last + 1) row ranges of the chunks that may hold [start, end]. """
+        use = numpy.ones(len(self.index), bool)
+        if start is not None:
+            use &= self.index['tsMax'] >= start
+        if end is not None:
+            use &= self.index['tsMin'] <= end
+        ranges = []
+        for first, count in zip(self.index['first'][use],
+                                self.index['count'][use]):
+            first, count = int(first), int(count)
+            if ranges and ranges[-1][1] == first:
+                ranges[-1][1] = first + count
+            else:
+                ranges.append([first, first + count])
+        return ranges
+
+    def query(self, start=None, end=None, src=None, dst=None, proto=None,
+              minTTL=None, maxTTL=None, limit=None, packed=False):
+        """
+        Records with start <= ts <= end and the given source, destination,
+        protocol and TTL range, as a structured array in storage order.
+        Addresses are printable, or packed with packed=True. limit caps
+        the number returned.
+        """
+        cols = self.columns
+        matches = []
+        found = 0
+        if not packed:
+            src = src and parseAddr(src)
+            dst = dst and parseAddr(dst)
+        for first, last in self.rowRanges(start, end):
+            mask = numpy.ones(last - first, bool)
+            ts = cols['ts'][first:last]
+            if start is not None:
+                mask &= ts >= start
+            if end is not None:
+                mask &= ts <= end
+            for value, name in ((src, 'src'), (dst, 'dst')):
+                if value is not None:
+                    # Addresses are compared as two 64-bit halves. IPv4
+                    # ones are NUL padded, so the version tells 10.0.0.0
+                    # from a:: and friends
+                    mask &= cols['version'][first:last] == \
+                        (len(value) == 4 and 4 or 6)
+                    lanes = cols[name][first:last].view('u8').reshape(-1, 2)
+                    key = numpy.frombuffer(value.ljust(16, '\0'), 'u8')
+                    mask &= (lanes[:, 0] == key[0]) & (lanes[:, 1] == key[1])
+            if proto is not None:
+                mask &= cols['proto'][first:last] == proto
+            if minTTL is not None:
+                mask &= cols['ttl'][first:last] >= minTTL
+            if maxTTL is not None:
+                mask &= cols['ttl'][first:last] <= maxTTL
+            rows = numpy.flatnonzero(mask) + first
+            if limit is not None:
+                rows = rows[:limit - found]
+            if len(rows):
+                matches.append(self.take(rows))
+                found += len(rows)
+            if limit is not None and found >= limit:
+                break
+        if not matches:
+            return numpy.zeros(0, DTYPE)
+        return numpy.concatenate(matches)
+
+    def take(self, rows):
+        """ The records at the given row numbers, as a structured array. """
+        out = numpy.empty(len(rows), DTYPE)
+        for name, kind in COLUMNS:
+            out[name] = self.columns[name][rows]
+        return out
+
+
+def record(row):
+    """ (ts, record tuple) of one row of a query result. """
+    size = row['version'] == 4 and 4 or 16
+    return float(row['ts']), (int(row['version']),
+                              row['src'].ljust(size, '\0'),
+                              row['dst'].ljust(size, '\0'), int(row['proto']),
+                              int(row['ttl']), int(row['length']))
+
+
+def main():
+    parser = OptionParser(usage='%prog [options] STORE')
+    parser.add_option('--last', type='float',
+                      help='only the last LAST seconds')
+    parser.add_option('--src', help='source address')
+    parser.add_option('--dst', help='destination address')
+    parser.add_option('--proto', type='int', help='IP protocol number')
+    parser.add_option('--min-ttl', type='int')
+    parser.add_option('--max-ttl', type='int')
+    parser.add_option('--limit', type='int', default=100,
+                      help='most records to print')
+    opts, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('need a store directory')
+    reader = StoreReader(args[0])
+    start = opts.last and time.time() - opts.last
+    t = time.time()
+    hits = reader.query(start, None, opts.src, opts.dst, opts.proto,
+                        opts.min_ttl, opts.max_ttl, opts.limit)
+    elapsed = time.time() - t
+    for row in hits:
+        ts, rec = record(row)
+        print '%.6f %s > %s proto %d ttl %d len %d' % (
+            ts, decode.formatAddr(rec[1]), decode.formatAddr(rec[2]), rec[3],
+            rec[4], rec[5])
+    print >>sys.stderr, '%d records shown of %d stored, %.1f ms' % (
+        len(hits), len(reader), elapsed * 1000)
+
+
+if __name__ == '__main__':
+    main()
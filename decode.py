@@ -0,0 +1,123 @@
+"""
+Fast-path header decoder for raw Ethernet frames.
+
+Instead of building a scapy packet per frame, the few header fields the
+GUI needs are read straight out of the frame bytes with precompiled
+structs. Works on str, bytearray, mmap and memoryview frames alike and
+never copies the payload.
+
+A decoded frame is a record tuple
+
+    (version, src, dst, proto, ttl, length)
+
+where version is 4 or 6, src and dst are the packed 4 or 16 byte
+addresses, proto is the IP protocol (IPv6 next header), ttl the TTL (hop
+limit) and length the IP datagram length, which for IPv6 (payload length
+plus the fixed header) can exceed 65535. RECORD packs a record, with a
+timestamp in front, into a fixed-size binary form.
+"""
+
+import socket, struct
+
+ETH_HLEN = 14
+ETHERTYPE_IP = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_ARP = 0x0806
+VLAN_TYPES = (0x8100, 0x88a8, 0x9100)
+
+_ethertype = struct.Struct('!H')
+# version/ihl, tos, total length, id, frag, ttl, proto, csum, src, dst
+_ipv4 = struct.Struct('!BxH4xBB2x4s4s')
+# version/class/flow, payload length, next header, hop limit, src, dst
+_ipv6 = struct.Struct('!4xHBB16s16s')
+# hardware type, protocol type, sizes, operation, sender MAC/IP, target MAC/IP
+_arp = struct.Struct('!HHBBH6s4s6s4s')
+
+# timestamp, version, src, dst, proto, ttl, length
+RECORD = struct.Struct('!dB16s16sBBI')
+
+
+def decodeFrame(frame, start=0, end=None):
+    """
+    Decode the IP header of a raw Ethernet frame, skipping any VLAN tags.
+    Returns a record tuple, or None for non-IP or truncated frames.
+
+    start and end select a frame held inside a larger buffer, such as a
+    batch in shared memory, so it can be decoded without slicing it out.
+    """
+    if end is None:
+        end = len(frame)
+    etype, off = _network(frame, start, end)
+
+    if etype == ETHERTYPE_IP:
+        if end < off + 20:
+            return None
+        verihl, length, ttl, proto, src, dst = _ipv4.unpack_from(frame, off)
+        if verihl >> 4 != 4:
+            return None
+        return (4, src, dst, proto, ttl, length)
+
+    if etype == ETHERTYPE_IPV6:
+        if end < off + 40:
+            return None
+        plen, nh, hlim, src, dst = _ipv6.unpack_from(frame, off)
+        return (6, src, dst, nh, hlim, plen + 40)
+
+    return None
+
+
+def _network(frame, start, end):
+    """
+    Ethertype and offset of the network header, after any VLAN tags;
+    (None, None) if the frame is too short.
+    """
+    if end - start < ETH_HLEN:
+        return None, None
+    off = start + 12
+    etype, = _ethertype.unpack_from(frame, off)
+    while etype in VLAN_TYPES:
+        off += 4
+        if end < off + 2:
+            return None, None
+        etype, = _ethertype.unpack_from(frame, off)
+    return etype, off + 2
+
+
+def decodeArp(frame, start=0, end=None):
+    """
+    Decode an Ethernet/IPv4 ARP frame into (operation, sender MAC, sender
+    IP, target MAC, target IP), addresses packed. None for anything else.
+    """
+    if end is None:
+        end = len(frame)
+    etype, off = _network(frame, start, end)
+    if etype != ETHERTYPE_ARP or end < off + _arp.size:
+        return None
+    htype, ptype, hlen, plen, oper, sha, spa, tha, tpa = \
+        _arp.unpack_from(frame, off)
+    if ptype != ETHERTYPE_IP or hlen != 6 or plen != 4:
+        return None
+    return (oper, sha, spa, tha, tpa)
+
+
+def formatAddr(addr):
+    """ Printable form of a packed IPv4 or IPv6 address. """
+    if len(addr) == 4:
+        return socket.inet_ntoa(addr)
+    return socket.inet_ntop(socket.AF_INET6, addr)
+
+
+def packRecord(ts, rec):
+    """ Pack a timestamped record into RECORD.size bytes. """
+    return RECORD.pack(ts, *rec)
+
+
+def unpackRecord(data, offset=0):
+    """
+    Inverse of packRecord. Returns (ts, record); IPv4 addresses come back
+    trimmed to 4 bytes.
+    """
+    ts, version, src, dst, proto, ttl, length = RECORD.unpack_from(data, offset)
+    if version == 4:
+        src, dst = src[:4], dst[:4]
+    return ts, (version, src, dst, proto, ttl, length)
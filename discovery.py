@@ -0,0 +1,153 @@
+"""
+Topology discovery from captured traffic.
+
+Discovery turns every ARP and IP frame it is given into hosts and links
+of an incrementally maintained graph: a new address becomes a host, a
+new source/destination pair becomes a link, and the TTL a host's packets
+arrive with gives its distance in hops (counted down from the nearest
+common initial TTL, 32, 64, 128 or 255). ARP senders are on the local
+link, zero hops away.
+
+Hosts and links are dict entries, so each packet costs a few O(1)
+lookups and nothing is ever rebuilt. What changed is collected in a
+change feed that the GUI takes with takeChanges: new hosts and links in
+the order they appeared, and the latest hop count of every host whose
+distance changed. The feed grows with the changes to the graph, not
+with the packet rate.
+"""
+
+import threading
+
+import decode
+
+INITIAL_TTLS = (32, 64, 128, 255)
+
+
+def hopsFromTTL(ttl):
+    """ Hops travelled by a packet seen with ttl, assuming a usual initial TTL. """
+    for initial in INITIAL_TTLS:
+        if ttl <= initial:
+            return initial - ttl
+    return 0
+
+
+def isUnicast(addr):
+    """ False for broadcast, multicast and unspecified packed addresses. """
+    if len(addr) == 4:
+        first = ord(addr[0])
+        return 0 < first < 224 and addr != '\xff\xff\xff\xff'
+    return addr[0] != '\xff' and addr != '\0' * 16
+
+
+class Discovery:
+    """
+    Host/link graph built from traffic. The add methods are meant for the
+    capture thread, takeChanges for the GUI thread. notify, if given, is
+    called after every change to the graph.
+    """
+    def __init__(self, notify=None):
+        self.notify = notify
+        self.lock = threading.Lock()
+        # packed address -> [host id, MAC or None, hops or None]
+        self.hosts = {}
+        # (host id, host id), lower id first -> packets seen
+        self.links = {}
+        self.newHosts = []
+        self.newLinks = []
+        self.hopChanges = {}
+
+    def addFrame(self, frame):
+        """ Feed a raw Ethernet frame; anything but ARP and IP is ignored. """
+        rec = decode.decodeFrame(frame)
+        if rec is not None:
+            self.addRecord(rec)
+            return
+        arp = decode.decodeArp(frame)
+        if arp is not None:
+            self.addArp(arp)
+
+    def addRecord(self, rec):
+        """ Feed a decoded IP record. """
+        version, src, dst, proto, ttl, length = rec
+        if not isUnicast(src):
+            return
+        self.lock.acquire()
+        try:
+            changed = False
+            host = self.hosts.get(src)
+            if host is None:
+                host = self._addHost(src)
+                changed = True
+            # Multicast is often sent with a deliberately low TTL, so only
+            # unicast says anything about distance
+            if isUnicast(dst):
+                hops = hopsFromTTL(ttl)
+                if host[2] != hops:
+                    host[2] = hops
+                    self.hopChanges[host[0]] = hops
+                    changed = True
+                changed = self._addLink(host, dst) or changed
+        finally:
+            self.lock.release()
+        if changed and self.notify:
+            self.notify()
+
+    def addArp(self, arp):
+        """ Feed a decoded ARP message; its sender is on the local link. """
+        oper, sha, spa, tha, tpa = arp
+        if not isUnicast(spa):
+            return
+        self.lock.acquire()
+        try:
+            changed = False
+            host = self.hosts.get(spa)
+            if host is None:
+                host = self._addHost(spa)
+                changed = True
+            host[1] = sha
+            if host[2] != 0:
+                host[2] = 0
+                self.hopChanges[host[0]] = 0
+                changed = True
+            if isUnicast(tpa) and tpa != spa:
+                changed = self._addLink(host, tpa) or changed
+        finally:
+            self.lock.release()
+        if changed and self.notify:
+            self.notify()
+
+    def _addHost(self, addr):
+        host = [len(self.hosts), None, None]
+        self.hosts[addr] = host
+        self.newHosts.append((host[0], addr))
+        return host
+
+    def _addLink(self, host, dst):
+        """ Count a packet from host to dst; True if the link is new. """
+        other = self.hosts.get(dst)
+        new = other is None
+        if new:
+            other = self._addHost(dst)
+        a, b = host[0], other[0]
+        key = a < b and (a, b) or (b, a)
+        count = self.links.get(key)
+        if count is None:
+            self.links[key] = 1
+            self.newLinks.append(key)
+            return True
+        self.links[key] = count + 1
+        return new
+
+    def takeChanges(self):
+        """
+        Return and reset the change feed: (new hosts as (id, packed
+        address), new links as (id, id), {id: hops} for changed distances).
+        Hosts always come before the links that use them.
+        """
+        self.lock.acquire()
+        try:
+            changes = self.newHosts, self.newLinks, self.hopChanges
+            self.newHosts, self.newLinks, self.hopChanges = [], [], {}
+        finally:
+            self.lock.release()
+        return changes
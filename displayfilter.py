@@ -0,0 +1,412 @@
+"""
+Display filter language, evaluated over batches of decoded records.
+
+BPF decides what the kernel lets through; a display filter decides what
+is shown, and can ask things BPF cannot, like whether a TTL is unusual
+for its source or whether an address is in a set of 50,000. A filter is
+compiled once into a tree of NumPy operations and then applied to whole
+batches of records at a time, so its cost is a handful of array
+operations per batch whatever the number of packets in it.
+
+    src == 10.0.0.1 and ttl < 5
+    dst in 10.0.0.0/8 or dst in {192.168.1.1, fe80::1}
+    src in ::/0 and not dst in 0.0.0.0/0
+    src in $watch and not udp
+    ttl != usualttl
+    (tcp or udp) and len > 1000 and hops >= 3
+
+Fields: ts, version, src, dst, proto, ttl, len, hops (from the TTL, see
+discovery.hopsFromTTL) and usualttl (the TTL the source normally uses,
+from the filter's baseline). Numbers compare with == != < <= > >=,
+addresses with == and !=, and both with in {...}; addresses also with in
+a CIDR prefix or a named set, $name, given when compiling. Bare tcp, udp,
+icmp and icmp6 test the protocol, ip and ip6 the version. Combine with
+and, or, not (&&, ||, !) and parentheses.
+
+Address sets are kept as sorted arrays of fixed-size keys and looked up
+with searchsorted, prefixes as masked integer compares.
+"""
+
+import operator, re, socket
+
+import numpy
+
+import capturestore, discovery
+from bpf import FilterError
+
+BATCH = capturestore.DTYPE
+
+NUMBER_FIELDS = ('ts', 'version', 'proto', 'ttl', 'len', 'hops', 'usualttl')
+ADDRESS_FIELDS = ('src', 'dst')
+PROTOCOLS = {'icmp': 1, 'tcp': 6, 'udp': 17, 'icmp6': 58}
+VERSIONS = {'ip': 4, 'ip6': 6}
+
+_token = re.compile(r'''
+    \s*(?:
+      (?P<addr>\d+\.\d+\.\d+\.\d+(?:/\d+)?
+              |[0-9A-Fa-f]*:[0-9A-Fa-f:.]*(?:/\d+)?)
+     |(?P<num>\d+(?:\.\d*)?)
+     |(?P<name>\$?[A-Za-z_][A-Za-z_0-9]*)
+     |(?P<op>==|!=|<=|>=|<|>|&&|\|\||!|\(|\)|\{|\}|,)
+    )''', re.VERBOSE)
+
+# hopsFromTTL, as a lookup table for whole arrays of TTLs
+_hops = numpy.array([discovery.hopsFromTTL(t) for t in range(256)],
+                    numpy.uint8)
+
+
+class DisplayFilterError(FilterError):
+    pass
+
+
+def toBatch(records):
+    """ A BATCH array of (ts, record) pairs. """
+    return numpy.array([(ts,) + tuple(rec) for ts, rec in records], BATCH)
+
+
+def addressKey(addr):
+    """ Sort key of a packed address: its version byte, then 16 bytes. """
+    return chr(len(addr) == 4 and 4 or 6) + addr.ljust(16, '\0')
+
+
+def parseAddress(text):
+    """ Packed address and prefix length of an address or CIDR prefix. """
+    addr, slash, bits = text.partition('/')
+    try:
+        if ':' in addr:
+            packed = socket.inet_pton(socket.AF_INET6, addr)
+        else:
+            packed = socket.inet_aton(addr)
+    except socket.error:
+        raise DisplayFilterError('bad address %r' % text)
+    try:
+        bits = int(bits) if slash else len(packed) * 8
+    except ValueError:
+        raise DisplayFilterError('bad prefix length in %r' % text)
+    if bits > len(packed) * 8:
+        raise DisplayFilterError('bad prefix length in %r' % text)
+    return packed, bits
+
+
+class AddressSet:
+    """
+    A set of addresses and CIDR prefixes, e.g. a watch list, matched
+    against whole columns of addresses at once.
+    """
+    def __init__(self, items=()):
+        keys = []
+        self.prefixes = []
+        for item in items:
+            if not isinstance(item, tuple):
+                item = parseAddress(item)
+            packed, bits = item
+            if bits == len(packed) * 8:
+                keys.append(addressKey(packed))
+            else:
+                self.prefixes.append((packed, bits))
+        self.keys = numpy.unique(numpy.array(keys, 'S17'))
+
+    def __len__(self):
+        return len(self.keys) + len(self.prefixes)
+
+    def contains(self, cols, field):
+        keys = cols.key(field)
+        match = numpy.zeros(len(keys), bool)
+        if len(self.keys):
+            pos = numpy.searchsorted(self.keys, keys)
+            pos[pos == len(self.keys)] = 0
+            match |= self.keys[pos] == keys
+        for packed, bits in self.prefixes:
+            match |= cols.inPrefix(field, packed, bits)
+        return match
+
+
+class FirstSeenTTL:
+    """
+    Minimal usualttl baseline: the TTL each source was first seen with,
+    kept as sorted arrays so lookups and updates work on whole batches.
+    """
+    def __init__(self):
+        self.keys = numpy.zeros(0, 'S17')
+        self.ttls = numpy.zeros(0, numpy.uint8)
+
+    def usual(self, keys, ttls):
+        """
+        The usual TTL of each source, learning the new sources first, so
+        a source new in this batch is judged by its first record here.
+        """
+        pos = numpy.searchsorted(self.keys, keys)
+        pos[pos == len(self.keys)] = 0
+        known = self.keys[pos] == keys if len(self.keys) else \
+            numpy.zeros(len(keys), bool)
+        if not known.all():
+            new, first = numpy.unique(keys[~known], return_index=True)
+            keys2 = numpy.concatenate([self.keys, new])
+            order = numpy.argsort(keys2, kind='mergesort')
+            self.keys = keys2[order]
+            self.ttls = numpy.concatenate(
+                [self.ttls, ttls[~known][first]])[order]
+            pos = numpy.searchsorted(self.keys, keys)
+        return self.ttls[pos]
+
+
+class _Columns:
+    """ Columns of one batch, derived ones computed once on demand. """
+
+    def __init__(self, batch, filter):
+        self.batch = batch
+        self.filter = filter
+        self.cache = {}
+
+    def number(self, name):
+        cols = self.cache
+        if name not in cols:
+            batch = self.batch
+            if name == 'len':
+                cols[name] = batch['length']
+            elif name == 'hops':
+                cols[name] = _hops[batch['ttl']]
+            elif name == 'usualttl':
+                baseline = self.filter.baseline
+                cols[name] = baseline.usual(self.key('src'), batch['ttl'])
+            else:
+                cols[name] = batch[name]
+        return cols[name]
+
+    def bytes(self, field):
+        name = field + ':bytes'
+        if name not in self.cache:
+            self.cache[name] = numpy.ascontiguousarray(
+                self.batch[field]).view(numpy.uint8).reshape(-1, 16)
+        return self.cache[name]
+
+    def key(self, field):
+        """ addressKey of every address in field, as an S17 array. """
+        name = field + ':key'
+        if name not in self.cache:
+            raw = numpy.empty((len(self.batch), 17), numpy.uint8)
+            raw[:, 0] = numpy.where(self.batch['version'] == 4, 4, 6)
+            raw[:, 1:] = self.bytes(field)
+            self.cache[name] = raw.view('S17').ravel()
+        return self.cache[name]
+
+    def inPrefix(self, field, packed, bits):
+        version = self.batch['version']
+        raw = self.bytes(field)
+        if len(packed) == 4:
+            addrs = raw[:, :4].copy().view('>u4').ravel()
+            mask = (0xffffffff << (32 - bits)) & 0xffffffff
+            net = numpy.frombuffer(packed, '>u4')[0] & mask
+            return (version == 4) & ((addrs & mask) == net)
+        lanes = raw.copy().view('>u8')
+        match = version == 6
+        net = numpy.frombuffer(packed, '>u8')
+        for i in range(2):
+            lane = min(max(bits - 64 * i, 0), 64)
+            if lane:
+                mask = ((1 << lane) - 1) << (64 - lane)
+                match &= (lanes[:, i] & numpy.uint64(mask)) == \
+                    numpy.uint64(int(net[i]) & mask)
+        return match
+
+
+class DisplayFilter:
+
+    def __init__(self, text, sets=None, baseline=None):
+        """
+        Compile text. sets maps names for $name to AddressSets or to
+        iterables of addresses; baseline provides usualttl, by default a
+        FirstSeenTTL. Raises DisplayFilterError if text does not parse.
+        """
+        self.text = text
+        self.sets = {}
+        for name, items in (sets or {}).iteritems():
+            if not isinstance(items, AddressSet):
+                items = AddressSet(items)
+            self.sets[name] = items
+        if baseline is None:
+            baseline = FirstSeenTTL()
+        self.baseline = baseline
+        self.tokens = self._tokenize(text)
+        self.pos = 0
+        kind, self.test = self._or()
+        if self.pos != len(self.tokens):
+            raise DisplayFilterError('unexpected %r' % self.tokens[self.pos][1])
+        if kind != 'bool':
+            raise DisplayFilterError('%r is not a condition' % text)
+
+    def mask(self, batch):
+        """ Boolean array telling which records of batch match. """
+        if not len(batch):
+            return numpy.zeros(0, bool)
+        # An expression over constants only gives a single bool; it
+        # stands for every record
+        mask = numpy.asarray(self.test(_Columns(batch, self)), bool)
+        if mask.shape != (len(batch),):
+            mask = numpy.repeat(mask, len(batch))
+        return mask
+
+    def apply(self, records):
+        """ The (ts, record) pairs of records that match, in order. """
+        if not records:
+            return records
+        return [records[i] for i in numpy.flatnonzero(
+            self.mask(toBatch(records)))]
+
+    # Parser: recursive descent straight into closures over _Columns
+
+    def _tokenize(self, text):
+        tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            m = _token.match(text, pos)
+            if m is None or m.end() == pos:
+                raise DisplayFilterError('cannot parse %r' % text[pos:].strip())
+            kind = m.lastgroup
+            tokens.append((kind, m.group(kind)))
+            pos = m.end()
+        return tokens
+
+    def _peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos][1]
+        return None
+
+    def _next(self):
+        if self.pos >= len(self.tokens):
+            raise DisplayFilterError('unexpected end of filter')
+        self.pos += 1
+        return self.tokens[self.pos - 1]
+
+    def _expect(self, value):
+        kind, token = self._next()
+        if token != value:
+            raise DisplayFilterError('expected %r, got %r' % (value, token))
+
+    def _bool(self, node):
+        kind, fn = node
+        if kind != 'bool':
+            raise DisplayFilterError('expected a condition')
+        return fn
+
+    def _or(self):
+        node = self._and()
+        while self._peek() in ('or', '||'):
+            self._next()
+            left, right = self._bool(node), self._bool(self._and())
+            node = ('bool', lambda c, l=left, r=right: l(c) | r(c))
+        return node
+
+    def _and(self):
+        node = self._not()
+        while self._peek() in ('and', '&&'):
+            self._next()
+            left, right = self._bool(node), self._bool(self._not())
+            node = ('bool', lambda c, l=left, r=right: l(c) & r(c))
+        return node
+
+    def _not(self):
+        if self._peek() in ('not', '!'):
+            self._next()
+            inner = self._bool(self._not())
+            return ('bool', lambda c: numpy.logical_not(inner(c)))
+        return self._comparison()
+
+    def _comparison(self):
+        left = self._operand()
+        op = self._peek()
+        if op in ('==', '!=', '<', '<=', '>', '>='):
+            self._next()
+            return self._compare(left, op, self._operand())
+        if op == 'in':
+            self._next()
+            return self._membership(left)
+        return left
+
+    def _operand(self):
+        kind, token = self._next()
+        if token == '(':
+            node = self._or()
+            self._expect(')')
+            return node
+        if kind == 'num':
+            value = float(token)
+            return ('num', lambda c: value)
+        if kind == 'addr':
+            packed, bits = parseAddress(token)
+            if bits != len(packed) * 8:
+                raise DisplayFilterError('prefix %r needs "in"' % token)
+            key = numpy.array([addressKey(packed)], 'S17')
+            return ('addr', lambda c: key)
+        if token in NUMBER_FIELDS:
+            return ('num', lambda c: c.number(token))
+        if token in ADDRESS_FIELDS:
+            return ('addr', lambda c: c.key(token), token)
+        if token in PROTOCOLS:
+            proto = PROTOCOLS[token]
+            return ('bool', lambda c: c.batch['proto'] == proto)
+        if token in VERSIONS:
+            version = VERSIONS[token]
+            return ('bool', lambda c: c.batch['version'] == version)
+        raise DisplayFilterError('unknown name %r' % token)
+
+    def _compare(self, left, op, right):
+        if left[0] != right[0] or left[0] == 'bool':
+            raise DisplayFilterError('cannot compare with %s' % op)
+        if left[0] == 'addr' and op not in ('==', '!='):
+            raise DisplayFilterError('addresses only compare with == and !=')
+        l, r = left[1], right[1]
+        # The operators rather than the ufuncs, which cannot compare the
+        # S17 address keys
+        fn = {'==': operator.eq, '!=': operator.ne, '<': operator.lt,
+              '<=': operator.le, '>': operator.gt, '>=': operator.ge}[op]
+        return ('bool', lambda c: fn(l(c), r(c)))
+
+    def _membership(self, left):
+        kind, token = self._next()
+        if left[0] == 'addr' and len(left) == 3:
+            field = left[2]
+            if kind == 'name' and token.startswith('$'):
+                name = token[1:]
+                if name not in self.sets:
+                    raise DisplayFilterError('no address set named %r' % name)
+                return ('bool', lambda c: self.sets[name].contains(c, field))
+            if kind == 'addr':
+                addrs = AddressSet([token])
+            elif token == '{':
+                addrs = AddressSet(self._items('addr'))
+            else:
+                raise DisplayFilterError('expected a set after "in"')
+            return ('bool', lambda c: addrs.contains(c, field))
+        if left[0] == 'num' and token == '{':
+            values = numpy.array([float(v) for v in self._items('num')])
+            l = left[1]
+            return ('bool', lambda c: numpy.in1d(l(c), values))
+        raise DisplayFilterError('"in" needs an address or number field')
+
+    def _items(self, kind):
+        items = []
+        while True:
+            itemKind, token = self._next()
+            if itemKind != kind:
+                raise DisplayFilterError('unexpected %r in set' % token)
+            items.append(token)
+            kind2, sep = self._next()
+            if sep == '}':
+                return items
+            if sep != ',':
+                raise DisplayFilterError('expected "," or "}"')
+
+
+def readAddressSet(path):
+    """
+    An AddressSet of the addresses and prefixes in a file, one per line;
+    blank lines and # comments are skipped.
+    """
+    items = []
+    for line in open(path):
+        line = line.split('#', 1)[0].strip()
+        if line:
+            items.append(line)
+    return AddressSet(items)
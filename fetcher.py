@@ -0,0 +1,325 @@
+#!/usr/bin/python
+
+"""
+Pooled HTTP fetch engine for probing many URLs.
+
+A fixed number of worker threads, which is the concurrency bound, share
+per-host pools of keep-alive httplib connections, so probing hundreds of
+URLs on a few hosts costs a few connections and never a thread per URL.
+Each request has its own socket timeout, HEAD mode skips the bodies, and
+redirects are followed. Results are handed to a deliver callback from
+the worker threads; the GUI pairs it with a queue and a wakeup to take
+them in batches on its own thread.
+
+    f = Fetcher(queue.put, concurrency=8, timeout=5, head=True)
+    for url in urls:
+        f.fetch(url)
+    # deliver(Result) is called once per URL
+
+Run as a script to fetch some URLs, or with --check to run the engine
+against a stand-in HTTP server on the loopback interface.
+"""
+
+import BaseHTTPServer, httplib, Queue, socket, SocketServer, sys, \
+    threading, time, urlparse
+from optparse import OptionParser
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class Result:
+    """
+    Outcome of one fetch. status and headers (a mimetools.Message) are
+    None and error is set if the request failed.
+    """
+    def __init__(self, url, status=None, headers=None, length=0, error=None):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.length = length
+        self.error = error
+
+    def __str__(self):
+        if self.error is not None:
+            return '%s\nerror: %s' % (self.url, self.error)
+        return '%s\n%d\n%s' % (self.url, self.status, self.headers)
+
+
+class Fetcher:
+
+    def __init__(self, deliver, concurrency=8, timeout=10, head=True,
+                 maxPerHost=4, maxRedirects=5):
+        self.deliver = deliver
+        self.timeout = timeout
+        self.method = head and 'HEAD' or 'GET'
+        self.maxPerHost = maxPerHost
+        self.maxRedirects = maxRedirects
+        self.jobs = Queue.Queue()
+        self.lock = threading.Lock()
+        # (scheme, host:port) -> idle keep-alive connections
+        self.pools = {}
+        self.connections = 0
+        # Set by close; connections handed back after that are closed
+        self.closed = False
+        self.workers = [threading.Thread(target=self.worker)
+                        for i in range(concurrency)]
+        for t in self.workers:
+            t.daemon = True
+            t.start()
+
+    def fetch(self, url):
+        """ Queue url; its Result is delivered when done. """
+        self.jobs.put(url)
+
+    def close(self, cancel=False, timeout=None):
+        """
+        Stop the workers and drop the idle connections. The queued fetches
+        are finished first, or with cancel dropped without a Result. With
+        timeout, wait at most that long for the workers; fetches still in
+        flight then end on their own within the request timeout.
+        """
+        if cancel:
+            try:
+                while True:
+                    self.jobs.get_nowait()
+            except Queue.Empty:
+                pass
+        for t in self.workers:
+            self.jobs.put(None)
+        if timeout is not None:
+            deadline = time.time() + timeout
+        for t in self.workers:
+            if timeout is None:
+                t.join()
+            else:
+                t.join(max(deadline - time.time(), 0))
+        self.lock.acquire()
+        try:
+            self.closed = True
+            pools, self.pools = self.pools, {}
+        finally:
+            self.lock.release()
+        for pool in pools.itervalues():
+            for conn in pool:
+                conn.close()
+
+    def worker(self):
+        while True:
+            url = self.jobs.get()
+            if url is None:
+                return
+            try:
+                result = self.fetchOne(url)
+            except Exception as e:
+                # Whatever goes wrong, the URL still gets its Result and
+                # the worker lives on
+                result = Result(url, error=e)
+            self.deliver(result)
+
+    def checkout(self, key, fresh=False):
+        """ An idle connection to key, or a new one; and whether it is reused. """
+        self.lock.acquire()
+        try:
+            pool = self.pools.get(key)
+            if pool and not fresh:
+                return pool.pop(), True
+            self.connections += 1
+        finally:
+            self.lock.release()
+        scheme, netloc = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout), False
+        if scheme == 'http':
+            return httplib.HTTPConnection(netloc, timeout=self.timeout), False
+        raise ValueError('unsupported URL scheme %r' % scheme)
+
+    def checkin(self, key, conn):
+        self.lock.acquire()
+        try:
+            if not self.closed:
+                pool = self.pools.setdefault(key, [])
+                if len(pool) < self.maxPerHost:
+                    pool.append(conn)
+                    return
+        finally:
+            self.lock.release()
+        conn.close()
+
+    def request(self, key, path):
+        """
+        One request on a pooled connection. A kept-alive connection the
+        server has meanwhile closed is retried once on a fresh one.
+        """
+        fresh = False
+        while True:
+            conn, reused = self.checkout(key, fresh)
+            try:
+                conn.request(self.method, path)
+                if conn.sock is not None:
+                    conn.sock.settimeout(self.timeout)
+                resp = conn.getresponse()
+                body = resp.read()
+            except socket.timeout:
+                conn.close()
+                raise
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                if reused:
+                    fresh = True
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self.checkin(key, conn)
+            return resp, body
+
+    def fetchOne(self, url):
+        original = url
+        for i in range(self.maxRedirects + 1):
+            parts = urlparse.urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            resp, body = self.request((parts.scheme, parts.netloc), path)
+            location = resp.getheader('location')
+            if resp.status in REDIRECTS and location:
+                url = urlparse.urljoin(url, location)
+                continue
+            break
+        return Result(original, resp.status, resp.msg, len(body))
+
+
+class _StandIn(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ The stand-in server's pages, one per case check covers. """
+    protocol_version = 'HTTP/1.1'
+    delay = 0.5
+
+    def do_GET(self):
+        if self.path == '/redirect':
+            self.reply(302, location='/ok')
+        elif self.path == '/slow':
+            time.sleep(self.delay)
+            self.reply(200)
+        elif self.path == '/close':
+            self.reply(200, close=True)
+        elif self.path == '/hangup':
+            self.close_connection = 1
+        elif self.path == '/ok':
+            self.reply(200)
+        else:
+            self.reply(404)
+
+    do_HEAD = do_GET
+
+    def reply(self, status, location=None, close=False):
+        body = 'stand-in %d\n' % status
+        self.send_response(status)
+        if location:
+            self.send_header('Location', location)
+        if close:
+            self.send_header('Connection', 'close')
+            self.close_connection = 1
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, address):
+        # Clients giving up on /slow are part of the check
+        pass
+
+
+def check(head=True):
+    """
+    Fetch each page of a stand-in server on the loopback interface a few
+    times and compare with what it should give. Returns the failures.
+    """
+    server = _StandInServer(('127.0.0.1', 0), _StandIn)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    base = 'http://127.0.0.1:%d' % server.server_address[1]
+    # path -> expected status, or None for an error
+    expected = {'/ok': 200, '/redirect': 200, '/missing': 404, '/close': 200,
+                '/slow': None, '/hangup': None}
+    results = Queue.Queue()
+    f = Fetcher(results.put, concurrency=4, timeout=_StandIn.delay / 2,
+                head=head, maxPerHost=2)
+    rounds = 5
+    for i in range(rounds):
+        for path in expected:
+            f.fetch(base + path)
+    # Neither of these may cost a worker: an unsupported scheme, and
+    # something that is no URL at all
+    bad = ['ftp://127.0.0.1/', 42]
+    for url in bad:
+        f.fetch(url)
+    failures = []
+    for i in range(rounds * len(expected) + len(bad)):
+        try:
+            result = results.get(timeout=10)
+        except Queue.Empty:
+            failures.append('a result never came')
+            break
+        if result.url in bad:
+            ok = result.error is not None
+            if not ok:
+                failures.append(str(result))
+            continue
+        want = expected.get(result.url[len(base):])
+        if want is None:
+            ok = result.error is not None
+        else:
+            ok = result.error is None and result.status == want
+        if not ok:
+            failures.append(str(result))
+    connections = f.connections
+    f.close()
+    server.shutdown()
+    # Keep-alive: the pages that keep the connection open should have
+    # shared a few, not used one each
+    if connections >= rounds * len(expected):
+        failures.append('%d connections for %d requests' % (
+            connections, rounds * len(expected)))
+    return failures
+
+
+def main():
+    parser = OptionParser(usage='%prog [options] URL...')
+    parser.add_option('--get', action='store_true',
+                      help='GET the bodies instead of HEAD requests')
+    parser.add_option('--concurrency', type='int', default=8)
+    parser.add_option('--timeout', type='float', default=10)
+    parser.add_option('--check', action='store_true',
+                      help='test against a stand-in server instead')
+    opts, args = parser.parse_args()
+    if opts.check:
+        failures = check(not opts.get)
+        for failure in failures:
+            print failure
+        print >>sys.stderr, '%d failures' % len(failures)
+        sys.exit(failures and 1 or 0)
+    if not args:
+        parser.error('need URLs to fetch')
+    results = Queue.Queue()
+    f = Fetcher(results.put, opts.concurrency, opts.timeout, not opts.get)
+    for url in args:
+        f.fetch(url)
+    for url in args:
+        print results.get()
+    f.close()
+
+
+if __name__ == '__main__':
+    main()
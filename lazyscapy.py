@@ -0,0 +1,22 @@
+"""
+Load only the parts of scapy that are actually used.
+
+from scapy.all import * pulls in every layer and contrib module scapy
+has, which is most of a second of startup and a good part of the memory
+of a process that may never dissect a packet. The fast decoder does not
+need scapy at all; the dissecting path needs only Ethernet, IPv4 and
+IPv6. layers imports just those modules, the first time it is called.
+"""
+
+_layers = None
+
+
+def layers():
+    """ The (Ether, IP, IPv6) scapy classes, imported on first use. """
+    global _layers
+    if _layers is None:
+        from scapy.layers.l2 import Ether
+        from scapy.layers.inet import IP
+        from scapy.layers.inet6 import IPv6
+        _layers = (Ether, IP, IPv6)
+    return _layers
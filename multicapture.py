@@ -0,0 +1,217 @@
+"""
+Capture on several interfaces at once, merged in timestamp order.
+
+MultiCapture runs one capture-and-decode process per source, so the
+work spreads over as many cores as there are sources instead of sharing
+one thread's GIL. A source is an interface, or with fanout=N one of N
+sockets that share an interface through a PACKET_FANOUT group, which
+splits a busy NIC or bonded uplink by flow hash (or by receiving CPU,
+i.e. RSS queue, with FANOUT_CPU).
+
+Every source sends batches of packed decode.RECORDs to the calling
+process, which merges them into one stream with a k-way merge on the
+capture timestamps. Each source's records are already in time order, so
+the merge only has to wait for a source that has nothing buffered for
+at most window seconds; a record older than that can no longer be
+overtaken. The merge buffers at most maxBuffered records, and a source
+whose batches do not fit in the queue to the merge loses them, counted,
+rather than stalling its capture.
+
+Per source counters (captured, decoded, dropped, merged) are kept in
+shared memory and read with sourceStats.
+
+    m = MultiCapture(['eth0', 'eth1'], filter='ip')
+    m.start()
+    m.run(prn, stopper)     # prn(ts, record), in timestamp order
+    m.stop()
+"""
+
+import collections, heapq, multiprocessing, os, Queue, select, time
+
+import bpf, capture, decode
+
+CAPTURED, DECODED, DROPPED = range(3)
+
+
+def sourceMain(index, iface, fanout, filter, control, stop, results, counters,
+               snaplen, flushInterval, batchRecords):
+    """
+    Body of a source process: capture, decode and send the records off in
+    batches, when batchRecords are ready or flushInterval has passed.
+    """
+    cap = capture.LiveCapture(iface, filter, snaplen)
+    if fanout is not None:
+        cap.joinFanout(*fanout)
+    sock = cap.sock
+    decodeFrame = decode.decodeFrame
+    packRecord = decode.RECORD.pack
+    out = []
+    flushAt = time.time() + flushInterval
+    while not stop.is_set():
+        ready, _, _ = select.select([sock], [], [], flushInterval)
+        now = time.time()
+        if ready:
+            frame = sock.recv(snaplen)
+            counters[CAPTURED] += 1
+            rec = decodeFrame(frame)
+            if rec is not None:
+                counters[DECODED] += 1
+                out.append(packRecord(now, *rec))
+
+        if out and (len(out) >= batchRecords or now >= flushAt):
+            try:
+                results.put_nowait((index, ''.join(out)))
+            except Queue.Full:
+                counters[DROPPED] += len(out)
+            out = []
+        if now >= flushAt:
+            # Filter changes are rare, so look for one once a flush
+            # interval rather than for every frame
+            try:
+                cap.setFilter(control.get_nowait())
+            except Queue.Empty:
+                pass
+            flushAt = now + flushInterval
+
+    if out:
+        results.put((index, ''.join(out)))
+    results.put((index, None))
+    cap.close()
+
+
+class MultiCapture:
+
+    def __init__(self, ifaces, filter=None, fanout=1,
+                 fanoutMode=capture.FANOUT_HASH, snaplen=65535, window=0.05,
+                 maxBuffered=100000, queueSize=256, flushInterval=0.02,
+                 batchRecords=1024):
+        self.filter = filter
+        self.window = window
+        self.maxBuffered = maxBuffered
+        self.results = multiprocessing.Queue(queueSize)
+        self.stopEvent = multiprocessing.Event()
+        self.sources = []
+        self.controls = []
+        self.counters = []
+        self.processes = []
+        for n, iface in enumerate(ifaces):
+            # Fanout groups are per interface and must not clash with
+            # those of other programs
+            group = fanout > 1 and ((os.getpid() + n) & 0xffff, fanoutMode)
+            for i in range(fanout):
+                index = len(self.sources)
+                control = multiprocessing.Queue()
+                counters = multiprocessing.Array('L', 3, lock=False)
+                self.sources.append(fanout > 1 and '%s#%d' % (iface, i)
+                                    or iface)
+                self.controls.append(control)
+                self.counters.append(counters)
+                self.processes.append(multiprocessing.Process(
+                    target=sourceMain,
+                    args=(index, iface, group or None, filter, control,
+                          self.stopEvent, self.results, counters, snaplen,
+                          flushInterval, batchRecords)))
+        self.merged = [0] * len(self.sources)
+        self.running = len(self.sources)
+        self.live = [True] * len(self.sources)
+        # Per source deque of (ts, record) not merged yet
+        self.pending = [collections.deque() for s in self.sources]
+        self.buffered = 0
+
+    def start(self):
+        for p in self.processes:
+            p.daemon = True
+            p.start()
+
+    def setFilter(self, expr):
+        """
+        Refilter every source, each picking the new filter up within a
+        flush interval. The expression is compiled here first so a bad
+        one raises bpf.FilterError in the caller.
+        """
+        expr = expr and expr.strip()
+        if expr:
+            bpf.compileFilter(expr)
+        self.filter = expr or None
+        for control in self.controls:
+            control.put(expr)
+
+    def sourceStats(self):
+        """ A dict of counters per source, in source order. """
+        return [{'source': name, 'captured': c[CAPTURED],
+                 'decoded': c[DECODED], 'dropped': c[DROPPED],
+                 'merged': merged}
+                for name, c, merged in zip(self.sources, self.counters,
+                                           self.merged)]
+
+    def _take(self, timeout):
+        """ Move one batch from the queue into the pending deques. """
+        try:
+            index, batch = self.results.get(timeout=timeout)
+        except Queue.Empty:
+            return
+        if batch is None:
+            self.running -= 1
+            self.live[index] = False
+            return
+        unpack = decode.unpackRecord
+        pending = self.pending[index]
+        for off in xrange(0, len(batch), decode.RECORD.size):
+            pending.append(unpack(batch, off))
+        self.buffered += len(batch) // decode.RECORD.size
+
+    def _merge(self, prn, flush=False):
+        """
+        Hand prn every record that no source can overtake any more: all
+        of them with flush, else those older than window, or the oldest
+        while every live source has something pending or the buffer is
+        over maxBuffered.
+        """
+        pending = self.pending
+        heap = [(q[0][0], i) for i, q in enumerate(pending) if q]
+        heapq.heapify(heap)
+        waiting = sum(1 for i, q in enumerate(pending)
+                      if self.live[i] and not q)
+        watermark = time.time() - self.window
+        merged = self.merged
+        while heap:
+            ts, i = heap[0]
+            if not (flush or waiting == 0 or ts <= watermark or
+                    self.buffered > self.maxBuffered):
+                break
+            q = pending[i]
+            ts, rec = q.popleft()
+            prn(ts, rec)
+            merged[i] += 1
+            self.buffered -= 1
+            if q:
+                heapq.heapreplace(heap, (q[0][0], i))
+            else:
+                heapq.heappop(heap)
+                if self.live[i]:
+                    waiting += 1
+
+    def run(self, prn, stopper=None, timeout=1):
+        """
+        Call prn(ts, record) for every record of every source, in
+        timestamp order, until stopper() returns True or all sources
+        have finished.
+        """
+        wait = min(self.window, timeout)
+        while self.running and not (stopper and stopper()):
+            self._take(wait)
+            # Drain what else is already there before merging
+            while not self.results.empty():
+                self._take(0)
+            self._merge(prn)
+        if not self.running:
+            self._merge(prn, flush=True)
+
+    def stop(self):
+        """ Stop all sources and wait for them to exit. """
+        self.stopEvent.set()
+        # A process does not exit while it still has results in the pipe
+        while self.running:
+            self._take(1)
+        for p in self.processes:
+            p.join()
@@ -0,0 +1,101 @@
+"""
+Fixed-capacity ring of timestamped packet records for the log view.
+
+PacketRing keeps the last capacity records, as given to the GUI queue, in
+one preallocated NumPy structured array of RECORD-like rows (47 bytes
+each), so the log costs the same memory after an hour of capture as after
+a minute. Nothing is formatted when records are added; the view asks for
+the text of a row with format only when that row is on screen.
+
+Rows are numbered oldest first, 0 to len - 1. Appending to a full ring
+discards the oldest rows, so row numbers shift down by the number
+discarded; total counts every record ever appended.
+"""
+
+import time
+
+import numpy
+
+import decode
+
+DTYPE = numpy.dtype([('ts', 'f8'), ('version', 'u1'), ('src', 'S16'),
+                     ('dst', 'S16'), ('proto', 'u1'), ('ttl', 'u1'),
+                     ('length', 'u4')])
+
+
+class PacketRing:
+
+    def __init__(self, capacity=100000):
+        if capacity <= 0:
+            raise ValueError('PacketRing needs a positive capacity')
+        self.capacity = capacity
+        self.rows = numpy.zeros(capacity, DTYPE)
+        self.head = 0
+        self.count = 0
+        self.total = 0
+
+    def __len__(self):
+        return self.count
+
+    def discard(self, n):
+        """ Drop the n oldest rows. """
+        n = min(n, self.count)
+        self.head = (self.head + n) % self.capacity
+        self.count -= n
+
+    def extend(self, records):
+        """
+        Append (ts, record) pairs, discarding the oldest rows to make room.
+        Returns the number of rows discarded.
+        """
+        records = records[-self.capacity:]
+        n = len(records)
+        if not n:
+            return 0
+        over = max(self.count + n - self.capacity, 0)
+        self.discard(over)
+        new = numpy.array([(ts,) + tuple(rec) for ts, rec in records], DTYPE)
+        start = (self.head + self.count) % self.capacity
+        first = min(n, self.capacity - start)
+        self.rows[start:start + first] = new[:first]
+        self.rows[:n - first] = new[first:]
+        self.count += n
+        self.total += n
+        return over
+
+    def row(self, i):
+        """ (ts, record) of row i. """
+        if not 0 <= i < self.count:
+            raise IndexError('row %d out of range' % i)
+        r = self.rows[(self.head + i) % self.capacity]
+        size = r['version'] == 4 and 4 or 16
+        # NumPy strips trailing NULs from fixed-size strings; put them back
+        return float(r['ts']), (int(r['version']), r['src'].ljust(size, '\0'),
+                                r['dst'].ljust(size, '\0'), int(r['proto']),
+                                int(r['ttl']), int(r['length']))
+
+    def format(self, i, names=None):
+        """
+        The text shown for row i. names, if given, maps a packed address
+        to a host name, or None to show the address.
+        """
+        ts, rec = self.row(i)
+        src = names and names(rec[1]) or decode.formatAddr(rec[1])
+        return '%s.%03d  [+] Pkt Received From: %s with TTL: %d' % (
+            time.strftime('%H:%M:%S', time.localtime(ts)),
+            int(ts * 1000) % 1000, src, rec[4])
+
+    def find(self, ts):
+        """
+        First row received at or after ts, or len if there is none.
+        Assumes rows arrive in time order.
+        """
+        # The ring is two sorted runs: from head to the end of the array,
+        # then from the start of the array
+        first = min(self.count, self.capacity - self.head)
+        older = self.rows['ts'][self.head:self.head + first]
+        i = int(numpy.searchsorted(older, ts))
+        if i < first:
+            return i
+        newer = self.rows['ts'][:self.count - first]
+        return first + int(numpy.searchsorted(newer, ts))
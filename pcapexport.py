@@ -0,0 +1,221 @@
+"""
+Background export of captured frames to rotating pcap or pcapng files.
+
+The capture thread tees every frame into PcapExport.write, which only
+copies it, behind a record header, into one of a few large preallocated
+buffers. A full buffer, or one that has been filling for flushInterval
+seconds, is handed to the export's own thread to be written out, and
+capture carries on in the next free buffer. When the disk is too slow
+and no buffer is free, frames are dropped and counted instead of making
+capture wait, so the live view never pays for the export.
+
+Files are named after prefix, the time they were opened and a sequence
+number, e.g. evidence-20240405-120000-000.pcap, and a new one is started
+once the current one holds rotateBytes or has been open rotateSeconds.
+With keep, only that many of the newest files are kept.
+
+    export = PcapExport('evidence', format='pcapng', rotateBytes=1 << 30)
+    export.write(frame)         # capture thread
+    export.flush()              # now and then, e.g. from the stopper
+    export.close()
+"""
+
+import os, struct, threading, time, Queue
+
+import pcapreplay
+
+FORMATS = ('pcap', 'pcapng')
+
+_pcapHeader = struct.Struct('<IHHiIII')
+_pcapRecord = struct.Struct('<IIII')
+# Section header block, then an interface description block for Ethernet
+_shb = struct.Struct('<IIIHHqI')
+_idb = struct.Struct('<IIHHII')
+# Enhanced packet block up to the frame data, and the trailing length
+_epb = struct.Struct('<IIIIIII')
+_blockEnd = struct.Struct('<I')
+
+
+class PcapExport:
+
+    def __init__(self, prefix, format='pcap', snaplen=65535,
+                 rotateBytes=1 << 30, rotateSeconds=3600, keep=0,
+                 bufferSize=4 << 20, buffers=8, flushInterval=1.0):
+        if format not in FORMATS:
+            raise ValueError('unknown export format %r' % format)
+        self.prefix = prefix
+        self.format = format
+        self.snaplen = snaplen
+        self.rotateBytes = rotateBytes
+        self.rotateSeconds = rotateSeconds
+        self.keep = keep
+        self.flushInterval = flushInterval
+        self.written = 0
+        self.dropped = 0
+        self.files = []
+        self.sequence = 0
+        # Frames lost to write errors, counted by the writer thread
+        self.failed = 0
+        # Buffers cycle from free, to the one being filled, to full and
+        # back to free once written
+        self.free = Queue.Queue()
+        for i in range(buffers - 1):
+            self.free.put(bytearray(bufferSize))
+        self.full = Queue.Queue()
+        self.buf = bytearray(bufferSize)
+        self.used = 0
+        self.frames = 0
+        self.started = time.time()
+        self.out = None
+        self.thread = threading.Thread(target=self.writer)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, frame, ts=None):
+        """
+        Add a frame captured at ts (default now). Never blocks; returns
+        False if the frame had to be dropped.
+        """
+        now = time.time()
+        if ts is None:
+            ts = now
+        caplen = min(len(frame), self.snaplen)
+        if self.format == 'pcap':
+            size = _pcapRecord.size + caplen
+        else:
+            size = _epb.size + ((caplen + 3) & ~3) + _blockEnd.size
+        buf = self.buf
+        if buf is None or self.used + size > len(buf):
+            self._handOver()
+            buf = self.buf
+        if buf is None or size > len(buf):
+            self.dropped += 1
+            return False
+
+        off = self.used
+        if self.format == 'pcap':
+            _pcapRecord.pack_into(buf, off, int(ts), int(ts % 1 * 1e6),
+                                  caplen, len(frame))
+            off += _pcapRecord.size
+            buf[off:off + caplen] = self._data(frame, caplen)
+        else:
+            usec = int(ts * 1e6)
+            _epb.pack_into(buf, off, pcapreplay.PCAPNG_EPB, size, 0,
+                           usec >> 32, usec & 0xffffffff, caplen, len(frame))
+            off += _epb.size
+            buf[off:off + caplen] = self._data(frame, caplen)
+            end = self.used + size - _blockEnd.size
+            buf[off + caplen:end] = '\0' * (end - off - caplen)
+            _blockEnd.pack_into(buf, end, size)
+        # How long a buffer has been filling goes by the clock, not by
+        # ts, which for a replayed file can be from long ago
+        if not self.frames:
+            self.started = now
+        self.used += size
+        self.frames += 1
+        if now - self.started >= self.flushInterval:
+            self._handOver()
+        return True
+
+    def _data(self, frame, caplen):
+        """ The first caplen bytes of frame, copying only if cut short. """
+        if caplen == len(frame):
+            return frame
+        return buffer(frame, 0, caplen)
+
+    def flush(self):
+        """
+        Hand over a buffer that has been filling for flushInterval, so a
+        trickle of frames still reaches the disk. Call from the thread
+        that calls write.
+        """
+        if self.frames and time.time() - self.started >= self.flushInterval:
+            self._handOver()
+
+    def _handOver(self):
+        if self.buf is not None and self.frames:
+            self.full.put((self.buf, self.used, self.frames))
+            self.buf = None
+        try:
+            self.buf = self.free.get_nowait()
+        except Queue.Empty:
+            # Every buffer waits for the disk; drop until one is back
+            pass
+        self.used = 0
+        self.frames = 0
+
+    def writer(self):
+        while True:
+            try:
+                item = self.full.get(timeout=1)
+            except Queue.Empty:
+                # Rotate on time even while nothing is captured
+                if self.out and time.time() >= self.rotateAt:
+                    self.out.close()
+                    self.out = None
+                continue
+            if item is None:
+                break
+            buf, used, frames = item
+            try:
+                if (self.out is None or self.outBytes >= self.rotateBytes or
+                        time.time() >= self.rotateAt):
+                    self._rotate()
+                self.out.write(buffer(buf, 0, used))
+                self.outBytes += used
+                self.written += frames
+            except EnvironmentError:
+                self.failed += frames
+                # Start afresh with the next buffer
+                if self.out:
+                    try:
+                        self.out.close()
+                    except EnvironmentError:
+                        pass
+                    self.out = None
+            self.free.put(buf)
+        if self.out:
+            self.out.close()
+
+    def _rotate(self):
+        """ Close the current file and start the next one. """
+        if self.out:
+            self.out.close()
+            self.out = None
+        name = '%s-%s-%03d.%s' % (self.prefix,
+                                  time.strftime('%Y%m%d-%H%M%S'),
+                                  self.sequence % 1000, self.format)
+        self.sequence += 1
+        out = open(name, 'wb')
+        if self.format == 'pcap':
+            out.write(_pcapHeader.pack(pcapreplay.PCAP_MAGIC, 2, 4, 0, 0,
+                                       self.snaplen,
+                                       pcapreplay.LINKTYPE_ETHERNET))
+            self.outBytes = _pcapHeader.size
+        else:
+            out.write(_shb.pack(pcapreplay.PCAPNG_SHB, _shb.size,
+                                pcapreplay.PCAPNG_BYTE_ORDER, 1, 0, -1,
+                                _shb.size))
+            out.write(_idb.pack(pcapreplay.PCAPNG_IDB, _idb.size,
+                                pcapreplay.LINKTYPE_ETHERNET, 0,
+                                self.snaplen, _idb.size))
+            self.outBytes = _shb.size + _idb.size
+        self.out = out
+        self.rotateAt = time.time() + self.rotateSeconds
+        self.files.append(name)
+        if self.keep:
+            while len(self.files) > self.keep:
+                try:
+                    os.unlink(self.files.pop(0))
+                except OSError:
+                    pass
+
+    def close(self):
+        """ Write out what is buffered and stop the writer thread. """
+        self._handOver()
+        self.full.put(None)
+        self.thread.join()
+
+    def status(self):
+        return 'export %d written, %d dropped, %d failed, %d files' % (
+            self.written, self.dropped, self.failed, len(self.files))
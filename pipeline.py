@@ -0,0 +1,194 @@
+"""
+Multi-process capture and decode pipeline.
+
+One capture process reads frames off a LiveCapture socket and packs them,
+in batches, into the slots of a ring of shared memory. A pool of decode
+worker processes takes filled slots, decodes every frame in place with
+decode.decodeFrame and sends back nothing but the packed RECORD of each
+IP frame. Only slot numbers and those compact records ever go through a
+multiprocessing queue, so the GUI process does no capture or decode work
+and nothing it does competes with them for the GIL.
+
+    p = Pipeline(workers=4, filter='ip')
+    p.start()
+    p.run(prn, stopper)     # prn(ts, record) in the calling process
+    p.stop()
+"""
+
+import mmap, multiprocessing, Queue, select, struct, time
+
+import bpf, capture, decode
+
+# Per frame header inside a slot: capture timestamp, frame length
+_frameHeader = struct.Struct('dI')
+
+
+class SharedRing:
+    """
+    A fixed number of fixed-size slots in anonymous shared memory, inherited
+    by every process forked after it is created. Slot ownership moves
+    between the producer and the consumers through the free and filled
+    queues, which carry only (slot, length) pairs.
+    """
+    def __init__(self, slots=64, slotSize=1 << 20):
+        self.slots = slots
+        self.slotSize = slotSize
+        self.mem = mmap.mmap(-1, slots * slotSize)
+        self.free = multiprocessing.Queue()
+        self.filled = multiprocessing.Queue()
+        for i in range(slots):
+            self.free.put(i)
+
+
+def captureMain(ring, iface, filter, control, stop, snaplen, flushInterval):
+    """
+    Body of the capture process: fill slots with batches of frames and
+    hand them over when they are full or flushInterval seconds old.
+    """
+    cap = capture.LiveCapture(iface, filter, snaplen)
+    sock = cap.sock
+    mem = ring.mem
+    header = _frameHeader
+    hsize = header.size
+    slotSize = ring.slotSize
+
+    slot = ring.free.get()
+    base = pos = slot * slotSize
+    limit = base + slotSize
+    flushAt = time.time() + flushInterval
+    while not stop.is_set():
+        ready, _, _ = select.select([sock], [], [], flushInterval)
+        if ready:
+            frame = sock.recv(snaplen)
+            n = len(frame)
+            if pos + hsize + n > limit:
+                ring.filled.put((slot, pos - base))
+                slot = ring.free.get()
+                base = pos = slot * slotSize
+                limit = base + slotSize
+            header.pack_into(mem, pos, time.time(), n)
+            mem[pos + hsize:pos + hsize + n] = frame
+            pos += hsize + n
+
+        now = time.time()
+        if now >= flushAt:
+            if pos > base:
+                ring.filled.put((slot, pos - base))
+                slot = ring.free.get()
+                base = pos = slot * slotSize
+                limit = base + slotSize
+            # Filter changes are rare, so look for one once a flush
+            # interval rather than for every frame
+            try:
+                cap.setFilter(control.get_nowait())
+            except Queue.Empty:
+                pass
+            flushAt = now + flushInterval
+
+    if pos > base:
+        ring.filled.put((slot, pos - base))
+    cap.close()
+
+
+def decodeMain(ring, results):
+    """
+    Body of a decode worker: decode every frame of every slot it gets and
+    put the packed records of the batch on results as one string.
+    """
+    mem = ring.mem
+    header = _frameHeader
+    hsize = header.size
+    packRecord = decode.RECORD.pack
+    decodeFrame = decode.decodeFrame
+    while True:
+        item = ring.filled.get()
+        if item is None:
+            break
+        slot, length = item
+        pos = slot * ring.slotSize
+        end = pos + length
+        out = []
+        while pos < end:
+            ts, n = header.unpack_from(mem, pos)
+            pos += hsize
+            rec = decodeFrame(mem, pos, pos + n)
+            if rec is not None:
+                out.append(packRecord(ts, *rec))
+            pos += n
+        ring.free.put(slot)
+        if out:
+            results.put(''.join(out))
+    results.put(None)
+
+
+class Pipeline:
+    """
+    Capture process plus a pool of decode worker processes, with the GUI
+    side reduced to draining compact records.
+    """
+    def __init__(self, workers=2, iface=None, filter=None, slots=64,
+                 slotSize=1 << 20, snaplen=65535, flushInterval=0.05):
+        self.workers = workers
+        self.ring = SharedRing(slots, slotSize)
+        self.results = multiprocessing.Queue()
+        self.control = multiprocessing.Queue()
+        self.stopEvent = multiprocessing.Event()
+        self.filter = filter
+        self.running = workers
+        self.capturer = multiprocessing.Process(
+            target=captureMain,
+            args=(self.ring, iface, filter, self.control, self.stopEvent,
+                  snaplen, flushInterval))
+        self.decoders = [multiprocessing.Process(target=decodeMain,
+                                                 args=(self.ring, self.results))
+                         for i in range(workers)]
+
+    def start(self):
+        for p in [self.capturer] + self.decoders:
+            p.daemon = True
+            p.start()
+
+    def setFilter(self, expr):
+        """
+        Refilter the capture process, which picks the new filter up
+        within a flush interval. The expression is compiled here first
+        so a bad one raises bpf.FilterError in the caller.
+        """
+        expr = expr and expr.strip()
+        if expr:
+            bpf.compileFilter(expr)
+        self.filter = expr or None
+        self.control.put(expr)
+
+    def run(self, prn, stopper=None, timeout=1):
+        """
+        Call prn(ts, record) for every decoded record until stopper()
+        returns True or all the workers have finished.
+        """
+        unpack = decode.unpackRecord
+        size = decode.RECORD.size
+        while self.running and not (stopper and stopper()):
+            try:
+                batch = self.results.get(timeout=timeout)
+            except Queue.Empty:
+                continue
+            if batch is None:
+                self.running -= 1
+                continue
+            for off in xrange(0, len(batch), size):
+                ts, rec = unpack(batch, off)
+                prn(ts, rec)
+
+    def stop(self):
+        """ Stop capturing, let the workers finish their slots and exit. """
+        self.stopEvent.set()
+        self.capturer.join()
+        for p in self.decoders:
+            self.ring.filled.put(None)
+        # A process does not exit while it still has results in the pipe,
+        # so whatever run did not consume has to be drained here
+        while self.running:
+            if self.results.get() is None:
+                self.running -= 1
+        for p in self.decoders:
+            p.join()
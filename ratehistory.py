@@ -0,0 +1,168 @@
+"""
+Packet and byte rate history per element, at several resolutions.
+
+Every element drawn with a rate history (a host, a link) is a series.
+The capture thread counts each packet against its series with add,
+which only bumps two running totals. Once a second tick turns the
+totals into rates for all series at once and writes them into fixed
+size rings of RESOLUTIONS: one point a second, every 10 seconds (the
+mean of the last 10) and every minute (the mean of the last 6 of those).
+Memory per series is fixed by the ring lengths and the work per tick
+follows the number of series, whatever the packet rate.
+
+For drawing, lttb downsamples a batch of series to as many points as
+there are pixels, keeping the peaks and dips a plain decimation would
+lose (Largest-Triangle-Three-Buckets, Steinarsson 2013). It works on all
+the rows together, so its cost is one array step per output point.
+
+    rates = RateHistory()
+    i = rates.addSeries()
+    rates.add(i, 1500)                  # capture thread
+    rates.tick()                        # once a second
+    x, y = lttb(rates.history(range(len(rates))), 40)
+"""
+
+import time
+
+import numpy
+
+PACKETS, BYTES = range(2)
+# (seconds per point, points kept)
+RESOLUTIONS = ((1, 300), (10, 360), (60, 1440))
+
+
+class RateHistory:
+
+    def __init__(self, resolutions=RESOLUTIONS, capacity=64):
+        self.resolutions = resolutions
+        self.count = 0
+        # Running totals per series, as lists so add is two list updates
+        self.packets = []
+        self.bytes = []
+        self.last = numpy.zeros((capacity, 2))
+        self.lastTick = None
+        self.ticks = 0
+        # Per resolution: (capacity, 2, points) of rates and where the
+        # next point goes
+        self.rings = [numpy.zeros((capacity, 2, points), numpy.float32)
+                      for step, points in resolutions]
+        self.heads = [0] * len(resolutions)
+
+    def __len__(self):
+        return self.count
+
+    def _reserve(self, n):
+        size = len(self.last)
+        if self.count + n <= size:
+            return
+        while size < self.count + n:
+            size *= 2
+        last = numpy.zeros((size, 2))
+        last[:self.count] = self.last[:self.count]
+        self.last = last
+        for level, ring in enumerate(self.rings):
+            grown = numpy.zeros((size,) + ring.shape[1:], numpy.float32)
+            grown[:self.count] = ring[:self.count]
+            self.rings[level] = grown
+
+    def addSeries(self):
+        """ Add a series with an empty history and return its index. """
+        self._reserve(1)
+        self.packets.append(0)
+        self.bytes.append(0)
+        self.count += 1
+        return self.count - 1
+
+    def add(self, i, length, packets=1):
+        """ Count packets of length bytes in all against series i. """
+        self.packets[i] += packets
+        self.bytes[i] += length
+
+    def tick(self, now=None):
+        """
+        Append the rates since the last tick to the finest rings, and to
+        the coarser ones when enough finer points have gathered.
+        """
+        now = now or time.time()
+        n = self.count
+        totals = numpy.empty((n, 2))
+        # A count that lands while these are copied shows up next tick
+        totals[:, PACKETS] = self.packets[:n]
+        totals[:, BYTES] = self.bytes[:n]
+        if self.lastTick is None:
+            self.last[:n] = totals
+            self.lastTick = now
+            return
+        elapsed = max(now - self.lastTick, 1e-3)
+        self._append(0, (totals - self.last[:n]) / elapsed)
+        self.last[:n] = totals
+        self.lastTick = now
+        self.ticks += 1
+
+        base = self.resolutions[0][0]
+        for level in range(1, len(self.resolutions)):
+            step = self.resolutions[level][0]
+            if self.ticks * base % step:
+                break
+            # The mean of the finer points this one covers
+            finer = self.resolutions[level - 1][0]
+            self._append(level, self._recent(level - 1, step // finer)
+                         .mean(axis=2))
+
+    def _append(self, level, rates):
+        ring = self.rings[level]
+        head = self.heads[level]
+        ring[:len(rates), :, head] = rates
+        self.heads[level] = (head + 1) % ring.shape[2]
+
+    def _recent(self, level, k):
+        """ The last k points of level, all series, (count, 2, k). """
+        ring = self.rings[level]
+        cols = (self.heads[level] - k + numpy.arange(k)) % ring.shape[2]
+        return ring[:self.count][:, :, cols]
+
+    def history(self, series, level=0, which=PACKETS):
+        """
+        Rates of some series at one resolution, oldest first, as a
+        (len(series), points) array.
+        """
+        ring = self.rings[level][numpy.asarray(series, int), which]
+        head = self.heads[level]
+        return numpy.concatenate([ring[:, head:], ring[:, :head]], axis=1)
+
+
+def lttb(y, n):
+    """
+    Downsample each row of y, points spaced evenly in time, to n points.
+    Returns (x, y) arrays of shape (rows, n): the indexes of the points
+    kept and their values. Rows of n points or fewer come back whole.
+    """
+    y = numpy.atleast_2d(y)
+    rows, m = y.shape
+    if m <= n or n < 3:
+        return numpy.tile(numpy.arange(m), (rows, 1)), y
+    r = numpy.arange(rows)
+    x = numpy.empty((rows, n), int)
+    x[:, 0] = 0
+    x[:, -1] = m - 1
+    # The first and last points stay; the rest go in n - 2 buckets
+    edges = numpy.linspace(1, m - 1, n - 1).astype(int)
+    edges[-1] = m - 1
+    a = numpy.zeros(rows, int)
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i < n - 3:
+            nlo, nhi = hi, edges[i + 2]
+        else:
+            nlo, nhi = m - 1, m
+        # Pick the point making the largest triangle with the point kept
+        # from the previous bucket and the mean of the next one
+        cx = (nlo + nhi - 1) / 2.0
+        cy = y[:, nlo:nhi].mean(axis=1)
+        ay = y[r, a]
+        xs = numpy.arange(lo, hi)
+        area = numpy.abs((a - cx)[:, None] * (y[:, lo:hi] - ay[:, None]) -
+                         (a[:, None] - xs) * (cy - ay)[:, None])
+        a = lo + area.argmax(axis=1)
+        x[:, i + 1] = a
+    return x, y[r[:, None], x]
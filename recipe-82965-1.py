@@ -20,6 +20,7 @@ import time
 import threading
 import random
 import Queue
+import boundedqueue, wakeup
 
 class GuiPart:
     def __init__(self, master, queue, endCommand):
@@ -27,6 +28,9 @@ class GuiPart:
         # Set up the GUI
         console = Tkinter.Button(master, text='Done', command=endCommand)
         console.pack()
+        # Overload counters of the queue, refreshed by processIncoming
+        self.status = Tkinter.Label(master)
+        self.status.pack()
         # Add more GUI stuff here
 
     def processIncoming(self):
@@ -41,6 +45,7 @@ class GuiPart:
                 print msg
             except Queue.Empty:
                 pass
+        self.status.config(text=self.queue.status())
 
 class ThreadedClient:
     """
@@ -56,8 +61,10 @@ class ThreadedClient:
         """
         self.master = master
 
-        # Create the queue
-        self.queue = Queue.Queue()
+        # Create the queue, bounded so a slow GUI cannot eat all memory.
+        # Every put wakes the GUI thread through a socket.
+        self.wakeup = wakeup.Wakeup()
+        self.queue = boundedqueue.BoundedQueue(notify=self.wakeup.notify)
 
         # Set up the GUI part
         self.gui = GuiPart(master, self.queue, self.endApplication)
@@ -68,13 +75,18 @@ class ThreadedClient:
     	self.thread1 = threading.Thread(target=self.workerThread1)
         self.thread1.start()
 
-        # Start the periodic call in the GUI to check if the queue contains
-        # anything
+        # Rather than checking the queue every 100 ms, have Tk call us
+        # whenever the wakeup socket says there is something in it
+        master.tk.createfilehandler(self.wakeup.fileno(), Tkinter.READABLE,
+                                    self.wakeupCall)
+
+    def wakeupCall(self, fd, mask):
+        self.wakeup.clear()
         self.periodicCall()
 
     def periodicCall(self):
         """
-        Check every 100 ms if there is something new in the queue.
+        Handle whatever is new in the queue.
         """
         self.gui.processIncoming()
         if not self.running:
@@ -82,7 +94,6 @@ class ThreadedClient:
             # some cleanup before actually shutting it down.
             import sys
             sys.exit(1)
-        self.master.after(100, self.periodicCall)
 
     def workerThread1(self):
         """
@@ -101,9 +112,12 @@ class ThreadedClient:
 
     def endApplication(self):
         self.running = 0
+        self.wakeup.notify()
 
 rand = random.Random()
-root = Tkinter.Tk()
 
-client = ThreadedClient(root)
-root.mainloop()
+if __name__ == '__main__':
+    root = Tkinter.Tk()
+
+    client = ThreadedClient(root)
+    root.mainloop()
@@ -0,0 +1,152 @@
+"""
+Background reverse DNS for labelling addresses with host names.
+
+A reverse lookup can take seconds, so nothing on the packet or drawing
+path ever waits for one. name(addr) answers from the cache straight
+away, or returns None and leaves the lookup to a small pool of worker
+threads; callback(addr, name) is called from the worker when the answer
+is in, for the caller to fill in its label.
+
+Only one lookup per address is ever in flight however often it is asked
+for (single flight). Answers are cached for ttl seconds, failures for
+negativeTTL, and the cache holds at most capacity addresses, evicting
+the least recently used. When more than maxPending lookups are waiting
+the new ones are dropped, counted, and tried again on the next ask.
+
+lookup is what resolves a packed address to a name, raising an error or
+returning None when it has none. By default it is the system resolver;
+hostsLookup(path) reads a hosts file instead, which is handy for tests
+and for networks without reverse DNS.
+
+    names = Resolver(callback=lambda addr, name: ...)
+    label = names.name(addr) or decode.formatAddr(addr)
+"""
+
+import collections, socket, threading, time, Queue
+
+import decode
+
+
+def systemLookup(addr):
+    """ Name of a packed address from the system resolver. """
+    return socket.gethostbyaddr(decode.formatAddr(addr))[0]
+
+
+def hostsLookup(path):
+    """ A lookup function answering from a hosts(5) style file. """
+    names = {}
+    for line in open(path):
+        fields = line.split('#', 1)[0].split()
+        if len(fields) < 2:
+            continue
+        try:
+            if ':' in fields[0]:
+                addr = socket.inet_pton(socket.AF_INET6, fields[0])
+            else:
+                addr = socket.inet_aton(fields[0])
+        except socket.error:
+            continue
+        # The first name for an address is its canonical one
+        names.setdefault(addr, fields[1])
+    return names.get
+
+
+class Resolver:
+
+    def __init__(self, callback=None, lookup=systemLookup, workers=4,
+                 capacity=65536, ttl=3600, negativeTTL=300, maxPending=1024):
+        self.callback = callback
+        self.lookup = lookup
+        self.capacity = capacity
+        self.ttl = ttl
+        self.negativeTTL = negativeTTL
+        self.lock = threading.Lock()
+        # addr -> (expiry time, name or None), least recently used first
+        self.cache = collections.OrderedDict()
+        self.inflight = set()
+        self.pending = Queue.Queue(maxPending)
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0
+        self.failed = 0
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self.worker)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def name(self, addr):
+        """
+        The cached name of packed address addr, or None if there is none
+        (yet). Never blocks; a lookup is started if needed.
+        """
+        now = time.time()
+        self.lock.acquire()
+        try:
+            entry = self.cache.pop(addr, None)
+            if entry is not None and entry[0] > now:
+                self.cache[addr] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if addr in self.inflight:
+                return None
+            try:
+                self.pending.put_nowait(addr)
+            except Queue.Full:
+                self.dropped += 1
+                return None
+            self.inflight.add(addr)
+        finally:
+            self.lock.release()
+        return None
+
+    def worker(self):
+        while True:
+            addr = self.pending.get()
+            if addr is None:
+                return
+            try:
+                name = self.lookup(addr)
+            except (socket.error, EnvironmentError, UnicodeError):
+                name = None
+            now = time.time()
+            self.lock.acquire()
+            try:
+                if name is None:
+                    self.failed += 1
+                    expiry = now + self.negativeTTL
+                else:
+                    expiry = now + self.ttl
+                self.cache.pop(addr, None)
+                self.cache[addr] = (expiry, name)
+                while len(self.cache) > self.capacity:
+                    self.cache.popitem(last=False)
+                self.inflight.discard(addr)
+            finally:
+                self.lock.release()
+            if self.callback:
+                self.callback(addr, name)
+
+    def close(self):
+        """
+        Stop the workers after the lookups they are doing now. Lookups
+        still waiting are dropped, so this never blocks.
+        """
+        try:
+            while True:
+                self.pending.get_nowait()
+        except Queue.Empty:
+            pass
+        for t in self.threads:
+            try:
+                self.pending.put_nowait(None)
+            except Queue.Full:
+                break
+
+    def status(self):
+        return 'names %d cached, %d in flight, %d hits, %d misses, ' \
+            '%d failed, %d dropped' % (len(self.cache), len(self.inflight),
+                                       self.hits, self.misses, self.failed,
+                                       self.dropped)
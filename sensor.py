@@ -0,0 +1,290 @@
+#!/usr/bin/python
+
+"""
+Headless capture sensor.
+
+Runs the same capture and decode path as the GUIs (LiveCapture, the
+mmap ring, the multi-process Pipeline, or a pcap/pcapng file) and streams
+one record per IP packet to stdout or a file, without importing any GUI
+toolkit or scapy, so it starts fast and runs on machines without a
+display.
+
+Output formats:
+
+    ndjson   one JSON object per line:
+             {"ts":1712345678.123456,"v":4,"src":"10.0.0.1",
+              "dst":"10.0.0.2","proto":6,"ttl":64,"len":60}
+    binary   per record a 2 byte big-endian length, then the record packed
+             as decode.RECORD
+
+Output goes through a large buffer and is flushed at least every
+flushInterval seconds, so a slow trickle of packets still shows up
+promptly at the other end of a pipe. With --store the records are also
+kept in a capture store for later queries, and with --export the raw
+frames in rotating pcap or pcapng files.
+
+    sensor.py --filter 'tcp port 80' > packets.ndjson
+    sensor.py --replay capture.pcapng --format binary -o records.bin
+"""
+
+# First, so the time spent on the imports below is measured
+import startup
+
+import errno, os, select, signal, struct, sys, time
+from optparse import OptionParser
+
+import capture, capturestore, decode, multicapture, pcapexport, pcapreplay
+import pipeline, ringcapture, stats
+
+startup.mark('imports')
+
+BASE_FILTER = 'ip or ip6'
+_length = struct.Struct('!H')
+
+
+def formatJSON(ts, rec):
+    return ('{"ts":%.6f,"v":%d,"src":"%s","dst":"%s","proto":%d,"ttl":%d,'
+            '"len":%d}\n' % (ts, rec[0], decode.formatAddr(rec[1]),
+                             decode.formatAddr(rec[2]), rec[3], rec[4],
+                             rec[5]))
+
+
+def formatBinary(ts, rec):
+    return _length.pack(decode.RECORD.size) + decode.packRecord(ts, rec)
+
+
+FORMATS = {'ndjson': formatJSON, 'binary': formatBinary}
+
+
+class Sensor:
+    """
+    Feeds every decoded record of a source to format and writes the result
+    to out. stop, e.g. from a signal handler, ends run at the next check.
+    """
+    flushInterval = 1.0
+
+    def __init__(self, source, out, format=formatJSON, store=None,
+                 pipelineStats=None, count=0, duration=0, export=None):
+        self.source = source
+        self.export = export
+        self.out = out
+        self.format = format
+        self.store = store
+        self.stats = pipelineStats or stats.PipelineStats()
+        self.count = count
+        self.deadline = duration and time.time() + duration
+        self.written = 0
+        self.running = True
+        self.lastFlush = time.time()
+
+    def stop(self, *args):
+        self.running = False
+
+    def frame(self, frame, ts=None):
+        if self.export:
+            self.export.write(frame, ts)
+        st = self.stats
+        st.captured += 1
+        try:
+            rec = decode.decodeFrame(frame)
+        except Exception:
+            st.failed += 1
+            return
+        if rec is None:
+            st.ignored += 1
+            return
+        self.record(ts or time.time(), rec)
+
+    def record(self, ts, rec):
+        if not self.running:
+            # Past count; the source only looks at stopper now and then
+            return
+        self.out.write(self.format(ts, rec))
+        if self.store:
+            self.store.append(ts, rec)
+        self.written += 1
+        if self.written == 1:
+            startup.firstPacket()
+        if self.written == self.count:
+            self.running = False
+
+    def block(self, ring, frames):
+        """ A block of frames from a RingCapture, decoded in place. """
+        st = self.stats
+        st.captured += len(frames)
+        decodeFrame = decode.decodeFrame
+        record = self.record
+        export = self.export
+        for ts, start, end in frames:
+            if export:
+                export.write(buffer(ring, start, end - start), ts)
+            try:
+                rec = decodeFrame(ring, start, end)
+            except Exception:
+                st.failed += 1
+                continue
+            if rec is None:
+                st.ignored += 1
+            else:
+                record(ts, rec)
+
+    def pipelineRecord(self, ts, rec):
+        self.stats.captured += 1
+        self.record(ts, rec)
+
+    def stopper(self):
+        """ Checked by the source every so often; also flushes output. """
+        now = time.time()
+        if now - self.lastFlush >= self.flushInterval:
+            self.out.flush()
+            self.lastFlush = now
+        if self.export:
+            self.export.flush()
+        if self.deadline and now >= self.deadline:
+            self.running = False
+        return not self.running
+
+    def run(self):
+        source = self.source
+        try:
+            if isinstance(source, (pipeline.Pipeline,
+                                   multicapture.MultiCapture)):
+                source.run(self.pipelineRecord, self.stopper, timeout=1)
+            elif isinstance(source, ringcapture.RingCapture):
+                source.runBlocks(self.block, self.stopper, timeout=1)
+            elif isinstance(source, pcapreplay.PcapReplay):
+                # Keep the file's own timestamps; headless there is no
+                # point in pacing
+                for i, (ts, frame) in enumerate(source.frames()):
+                    self.frame(frame, ts)
+                    if not i & 1023 and self.stopper():
+                        break
+            else:
+                source.run(self.frame, self.stopper, timeout=1)
+            self.out.flush()
+        except IOError as e:
+            # The reader went away; that is the end of the stream
+            if e.errno != errno.EPIPE:
+                raise
+        except select.error as e:
+            # A stop signal arrived while waiting for packets
+            if e.args[0] != errno.EINTR or self.running:
+                raise
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-i', '--iface', action='append', dest='ifaces',
+                      help='interface to capture on; repeat for several')
+    parser.add_option('--fanout', type='int', default=1,
+                      help='split each interface over this many capture '
+                           'processes')
+    parser.add_option('--filter', default='',
+                      help='BPF filter, on top of "%s"' % BASE_FILTER)
+    parser.add_option('--workers', type='int', default=0,
+                      help='capture and decode in this many processes')
+    parser.add_option('--ring', action='store_true', default=False,
+                      help='capture through a memory-mapped ring')
+    parser.add_option('--replay', metavar='FILE',
+                      help='read a pcap/pcapng file instead of sniffing')
+    parser.add_option('--format', choices=sorted(FORMATS), default='ndjson',
+                      help='ndjson or binary')
+    parser.add_option('-o', '--output', default='-',
+                      help='file to write to, - for stdout')
+    parser.add_option('-c', '--count', type='int', default=0,
+                      help='stop after this many records')
+    parser.add_option('--duration', type='float', default=0,
+                      help='stop after this many seconds')
+    parser.add_option('--store', metavar='DIR',
+                      help='also record every packet in a capture store')
+    parser.add_option('--export', metavar='PREFIX',
+                      help='also save the captured frames, as passed by '
+                           'the capture filter, to files named PREFIX-*')
+    parser.add_option('--export-format', choices=pcapexport.FORMATS,
+                      default='pcap', help='pcap or pcapng')
+    parser.add_option('--rotate-size', type='int', default=1024,
+                      metavar='MB', help='start a new export file after '
+                                         'this many megabytes')
+    parser.add_option('--rotate-time', type='int', default=3600,
+                      metavar='SECONDS', help='start a new export file '
+                                              'after this many seconds')
+    parser.add_option('--keep', type='int', default=0,
+                      help='keep only this many export files, 0 for all')
+    parser.add_option('--stats-file', metavar='FILE',
+                      help='write pipeline stats to FILE as JSON')
+    parser.add_option('--stats-interval', type='float', default=5.0,
+                      help='seconds between stats dumps')
+    opts, args = parser.parse_args()
+    if opts.fanout > 1 and not opts.ifaces:
+        parser.error('--fanout needs --iface')
+    ifaces = opts.ifaces or [None]
+    if opts.export and (opts.workers or opts.fanout > 1 or len(ifaces) > 1):
+        parser.error('--export needs a single capture process')
+
+    if opts.output == '-':
+        out = os.fdopen(os.dup(sys.stdout.fileno()), 'wb', 1 << 20)
+    else:
+        out = open(opts.output, 'wb', 1 << 20)
+    sensor = Sensor(None, out, FORMATS[opts.format], None,
+                    stats.PipelineStats(), opts.count, opts.duration)
+    # Before the source starts, so pipeline processes inherit the handlers
+    # instead of dying on the first ^C
+    signal.signal(signal.SIGINT, sensor.stop)
+    signal.signal(signal.SIGTERM, sensor.stop)
+
+    # Without a filter of the user's the decoder alone skips non-IP
+    # frames, so a sensor without libpcap or tcpdump still works
+    expr = None
+    if opts.filter.strip():
+        expr = '(%s) and (%s)' % (BASE_FILTER, opts.filter)
+    if opts.replay:
+        source = pcapreplay.PcapReplay(opts.replay, 0)
+    elif len(ifaces) > 1 or opts.fanout > 1:
+        source = multicapture.MultiCapture(ifaces, expr, opts.fanout)
+        source.start()
+        sensor.stats.sources = source.sourceStats
+    elif opts.workers:
+        source = pipeline.Pipeline(opts.workers, ifaces[0], expr)
+        source.start()
+    elif opts.ring:
+        source = ringcapture.RingCapture(ifaces[0], expr)
+    else:
+        source = capture.LiveCapture(ifaces[0], expr)
+    sensor.source = source
+    startup.mark('capture')
+
+    store = opts.store and capturestore.CaptureStore(opts.store)
+    sensor.store = store
+    export = opts.export and pcapexport.PcapExport(
+        opts.export, opts.export_format, rotateBytes=opts.rotate_size << 20,
+        rotateSeconds=opts.rotate_time, keep=opts.keep)
+    sensor.export = export
+    dumper = opts.stats_file and stats.StatsDumper(
+        sensor.stats, opts.stats_file, opts.stats_interval)
+
+    try:
+        sensor.run()
+    finally:
+        if isinstance(source, (pipeline.Pipeline, multicapture.MultiCapture)):
+            source.stop()
+        else:
+            source.close()
+        if store:
+            store.close()
+        if dumper:
+            dumper.stop()
+        if export:
+            export.close()
+            print >>sys.stderr, export.status()
+        try:
+            out.close()
+        except IOError:
+            pass
+    counts = sensor.stats.counts()
+    print >>sys.stderr, '%d records written, %d frames captured, ' \
+        '%d ignored, %d failed' % (sensor.written, counts['captured'],
+                                   counts['ignored'], counts['failed'])
+
+
+if __name__ == '__main__':
+    main()
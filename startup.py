@@ -0,0 +1,62 @@
+"""
+Cold start timing.
+
+Entry points mark the end of each startup phase with mark(name); the
+first packet to get through calls firstPacket, which reports how long
+every phase took, from the moment the process was started, on stderr:
+
+    startup: interpreter 0.021s, imports 0.094s, gui 0.180s,
+             capture 0.004s, first packet 0.310s (total 0.609s)
+
+Only the first call to firstPacket does anything, so it is cheap to
+call from a per-batch path.
+"""
+
+import os, sys, time
+
+
+def processStart():
+    """ Wall clock time the process was started, or now if unknown. """
+    now = time.time()
+    try:
+        stat = open('/proc/self/stat').read()
+        uptime = float(open('/proc/uptime').read().split()[0])
+    except (IOError, ValueError):
+        return now
+    # Field 22, counted after the parenthesised command name
+    ticks = int(stat[stat.rindex(')') + 2:].split()[19])
+    return now - (uptime - float(ticks) / os.sysconf('SC_CLK_TCK'))
+
+
+class Startup:
+
+    def __init__(self):
+        self.start = processStart()
+        self.last = self.start
+        self.phases = []
+        self.reported = False
+        self.mark('interpreter')
+
+    def mark(self, name):
+        """ End the current phase, giving it name. """
+        now = time.time()
+        self.phases.append((name, max(now - self.last, 0)))
+        self.last = now
+
+    def firstPacket(self, out=None):
+        if self.reported:
+            return
+        self.reported = True
+        self.mark('first packet')
+        (out or sys.stderr).write(self.report() + '\n')
+
+    def report(self):
+        return 'startup: %s (total %.3fs)' % (
+            ', '.join('%s %.3fs' % phase for phase in self.phases),
+            self.last - self.start)
+
+
+# One per process; the interpreter phase ends when this is first imported
+timer = Startup()
+mark = timer.mark
+firstPacket = timer.firstPacket
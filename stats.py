@@ -0,0 +1,189 @@
+"""
+Per-stage counters and latency histograms for the capture pipeline.
+
+PipelineStats reports these stage counters:
+
+    captured    frames handed over by the capture source
+    decoded     frames that held an IP packet
+    ignored     frames that did not (ARP, truncated, ...)
+    failed      frames the decoder raised on
+    aggregated  records counted into an aggregation window
+    enqueued    messages accepted by the GUI queue
+    dropped     messages the GUI queue refused (full or sampled out)
+    rendered    messages the GUI has shown
+
+Only captured, ignored, failed, aggregated and rendered are counted as
+plain integer attributes, each bumped by just one thread, so without
+locks. The rest are worked out when a snapshot is taken, from these and
+from the counters the BoundedQueue keeps anyway, so the common path of a
+packet costs a single increment. Latencies go into Histograms with
+power-of-two microsecond buckets; per-packet ones are only timed for one
+packet in sampleEvery (captured & sampleMask == 0), which keeps the clock
+reads off the hot path too.
+
+snapshot turns it all into a dict of plain values for the GUI panel and
+for StatsDumper, which writes it to a JSON file every few seconds.
+"""
+
+import json, math, os, threading, time
+
+COUNTERS = ('captured', 'decoded', 'ignored', 'failed', 'aggregated',
+            'enqueued', 'dropped', 'rendered')
+
+
+class Histogram:
+    """
+    Latency histogram; bucket i counts latencies from 2**(i-1) up to 2**i
+    microseconds, bucket 0 everything under a microsecond.
+    """
+
+    def __init__(self, buckets=32):
+        self.buckets = [0] * buckets
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        bucket = math.frexp(seconds * 1e6)[1]
+        if bucket < 0:
+            bucket = 0
+        elif bucket >= len(self.buckets):
+            bucket = len(self.buckets) - 1
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, p):
+        """ Upper bound in seconds of the bucket holding the p-th percentile. """
+        if not self.count:
+            return 0.0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                break
+        return 2 ** i / 1e6
+
+    def snapshot(self):
+        return {'count': self.count,
+                'mean': self.count and self.total / self.count,
+                'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                'buckets': list(self.buckets)}
+
+
+class PipelineStats:
+
+    def __init__(self, queue=None, sampleEvery=64):
+        self.queue = queue
+        # A power of two, so sampling is a mask test
+        self.sampleMask = 2 ** int(math.log(sampleEvery, 2)) - 1
+        self.captured = 0
+        self.ignored = 0
+        self.failed = 0
+        self.aggregated = 0
+        self.rendered = 0
+        # capture to decoded, capture to shown, and GUI time per drain
+        self.decodeTime = Histogram()
+        self.queueTime = Histogram()
+        self.renderTime = Histogram()
+        self.started = time.time()
+        # Optional callable returning a list of per capture source dicts,
+        # such as MultiCapture.sourceStats
+        self.sources = None
+
+    def counts(self):
+        """ All stage counters as a dict. """
+        counts = {'captured': self.captured, 'ignored': self.ignored,
+                  'failed': self.failed, 'aggregated': self.aggregated,
+                  'rendered': self.rendered, 'enqueued': 0, 'dropped': 0}
+        counts['decoded'] = self.captured - self.ignored - self.failed
+        queue = self.queue
+        if queue is not None:
+            refused = queue.dropped + queue.sampledOut
+            counts['enqueued'] = queue.offered - refused
+            counts['dropped'] = refused
+        return counts
+
+    def snapshot(self, previous=None):
+        """
+        Counters, rates per second since the previous snapshot (since the
+        start if not given), queue depth and histograms as a JSON-ready
+        dict. Every reader keeps its own previous snapshot.
+        """
+        now = time.time()
+        counts = self.counts()
+        if previous is None:
+            then, before = self.started, dict.fromkeys(COUNTERS, 0)
+        else:
+            then, before = previous['time'], previous['counters']
+        seconds = max(now - then, 1e-6)
+        snap = {'time': now, 'uptime': now - self.started,
+                'counters': counts,
+                'rates': dict((name, (counts[name] - before[name]) / seconds)
+                              for name in COUNTERS),
+                'latency': {'decode': self.decodeTime.snapshot(),
+                            'queue': self.queueTime.snapshot(),
+                            'render': self.renderTime.snapshot()}}
+        if self.sources:
+            snap['sources'] = self.sources()
+        queue = self.queue
+        if queue is not None:
+            snap['queue'] = {'depth': queue.qsize(), 'size': queue.maxsize,
+                             'dropped': queue.dropped,
+                             'sampledOut': queue.sampledOut}
+        return snap
+
+
+def formatSnapshot(snap):
+    """ Lines of text for a stats panel. """
+    lines = ['%-10s %12s %10s' % ('stage', 'total', 'per sec')]
+    for name in COUNTERS:
+        lines.append('%-10s %12d %10.0f' % (name, snap['counters'][name],
+                                            snap['rates'][name]))
+    if 'queue' in snap:
+        lines.append('queue      %d/%d' % (snap['queue']['depth'],
+                                          snap['queue']['size']))
+    for source in snap.get('sources', ()):
+        lines.append('%-10s %12d captured, %d dropped' % (
+            source['source'], source['captured'], source['dropped']))
+    for stage in ('decode', 'queue', 'render'):
+        h = snap['latency'][stage]
+        lines.append('%-7s p50 %8.3f ms  p99 %8.3f ms' % (
+            stage, h['p50'] * 1000, h['p99'] * 1000))
+    return '\n'.join(lines)
+
+
+class StatsDumper:
+    """
+    Write stats.snapshot() to path as JSON every interval seconds,
+    replacing the file atomically so a reader never sees half of one.
+    """
+    def __init__(self, stats, path, interval=5.0):
+        self.stats = stats
+        self.path = path
+        self.interval = interval
+        self.previous = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+        self.dump()
+
+    def dump(self):
+        tmp = self.path + '.tmp'
+        f = open(tmp, 'w')
+        try:
+            self.previous = self.stats.snapshot(self.previous)
+            json.dump(self.previous, f)
+        finally:
+            f.close()
+        os.rename(tmp, self.path)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
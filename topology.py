@@ -0,0 +1,239 @@
+"""
+Array-backed topology model and vectorized layout.
+
+All nodes live in a handful of contiguous NumPy arrays instead of one
+Python object each: positions (2 x float32), kind and state (uint8), and
+an int32 pair per edge, which is 10 bytes per node plus 8 per edge. The
+arrays grow by doubling, so adding nodes is amortized O(1) and never
+rebuilds the model.
+
+Layouts work on whole arrays at once:
+
+    gridLayout          nodes in rows, in index order
+    hierarchicalLayout  one row per kind, e.g. switches above taps above
+                        computers, like the original hand-placed picture
+    forceLayout         Fruchterman-Reingold, with repulsion taken from the
+                        centroids of a coarse grid instead of every pair,
+                        so an iteration costs O(n * cells^2) rather than
+                        O(n^2). With onlyNew it places just the nodes added
+                        since the last layout and leaves the rest alone.
+"""
+
+import numpy
+
+SWITCH, COMPUTER, TAP, HOST = range(4)
+KIND_NAMES = ['switch', 'computer', 'tap', 'host']
+
+
+class Topology:
+
+    def __init__(self, capacity=1024):
+        self.count = 0
+        self.edgeCount = 0
+        self.pos = numpy.full((capacity, 2), numpy.nan, numpy.float32)
+        self.kind = numpy.zeros(capacity, numpy.uint8)
+        self.state = numpy.zeros(capacity, numpy.uint8)
+        self.edges = numpy.zeros((capacity, 2), numpy.int32)
+        self.random = numpy.random.RandomState(0)
+
+    def _reserveNodes(self, n):
+        needed = self.count + n
+        size = len(self.kind)
+        if needed <= size:
+            return
+        while size < needed:
+            size *= 2
+        pos = numpy.full((size, 2), numpy.nan, numpy.float32)
+        pos[:self.count] = self.pos[:self.count]
+        self.pos = pos
+        self.kind = numpy.resize(self.kind, size)
+        self.state = numpy.resize(self.state, size)
+
+    def _reserveEdges(self, n):
+        needed = self.edgeCount + n
+        size = len(self.edges)
+        if needed <= size:
+            return
+        while size < needed:
+            size *= 2
+        edges = numpy.zeros((size, 2), numpy.int32)
+        edges[:self.edgeCount] = self.edges[:self.edgeCount]
+        self.edges = edges
+
+    def addNode(self, kind, x=numpy.nan, y=numpy.nan):
+        """ Add a node and return its index. Unplaced nodes have NaN x/y. """
+        self._reserveNodes(1)
+        i = self.count
+        self.kind[i] = kind
+        self.state[i] = 0
+        self.pos[i] = (x, y)
+        self.count += 1
+        return i
+
+    def addNodes(self, kinds):
+        """ Add unplaced nodes of the given kinds; returns their indexes. """
+        kinds = numpy.asarray(kinds, numpy.uint8)
+        self._reserveNodes(len(kinds))
+        first = self.count
+        self.count += len(kinds)
+        self.kind[first:self.count] = kinds
+        self.state[first:self.count] = 0
+        self.pos[first:self.count] = numpy.nan
+        return numpy.arange(first, self.count)
+
+    def addEdge(self, a, b):
+        self._reserveEdges(1)
+        self.edges[self.edgeCount] = (a, b)
+        self.edgeCount += 1
+        return self.edgeCount - 1
+
+    def addEdges(self, pairs):
+        pairs = numpy.asarray(pairs, numpy.int32).reshape(-1, 2)
+        self._reserveEdges(len(pairs))
+        self.edges[self.edgeCount:self.edgeCount + len(pairs)] = pairs
+        self.edgeCount += len(pairs)
+
+    def position(self, i):
+        x, y = self.pos[i]
+        return float(x), float(y)
+
+    def positions(self):
+        """ (count, 2) view of the node positions. """
+        return self.pos[:self.count]
+
+    def edgeList(self):
+        """ (edgeCount, 2) view of the edges. """
+        return self.edges[:self.edgeCount]
+
+    def gridLayout(self, width, height, margin=20):
+        n = self.count
+        if not n:
+            return
+        cols = int(numpy.ceil(numpy.sqrt(n * float(width) / height)))
+        rows = int(numpy.ceil(n / float(cols)))
+        i = numpy.arange(n)
+        pos = self.pos[:n]
+        pos[:, 0] = margin + (i % cols + 0.5) * (width - 2 * margin) / cols
+        pos[:, 1] = margin + (i // cols + 0.5) * (height - 2 * margin) / rows
+
+    def hierarchicalLayout(self, width, height, levels=(SWITCH, TAP, COMPUTER,
+                                                        HOST), margin=20):
+        """
+        One evenly spaced row per kind, in the order given by levels.
+        Kinds not listed are not moved.
+        """
+        n = self.count
+        kind = self.kind[:n]
+        pos = self.pos[:n]
+        present = [k for k in levels if (kind == k).any()]
+        for row, k in enumerate(present):
+            members = numpy.flatnonzero(kind == k)
+            pos[members, 0] = margin + (numpy.arange(len(members)) + 0.5) * \
+                (width - 2 * margin) / len(members)
+            pos[members, 1] = margin + (row + 0.5) * \
+                (height - 2 * margin) / len(present)
+
+    def _placeNew(self, new, x0, y0, w, h):
+        """
+        Put unplaced nodes next to the mean of their placed neighbours, or
+        anywhere in the box if they have none.
+        """
+        n = self.count
+        pos = self.pos[:n]
+        edges = self.edgeList()
+        a, b = edges[:, 0], edges[:, 1]
+        sums = numpy.zeros((n, 2))
+        hits = numpy.zeros(n)
+        for src, dst in ((a, b), (b, a)):
+            use = new[dst] & ~new[src]
+            sums[:, 0] += numpy.bincount(dst[use], pos[src[use], 0], n)
+            sums[:, 1] += numpy.bincount(dst[use], pos[src[use], 1], n)
+            hits += numpy.bincount(dst[use], minlength=n)
+        near = new & (hits > 0)
+        far = new & (hits == 0)
+        jitter = 0.02 * min(w, h)
+        pos[near] = sums[near] / hits[near, None] + \
+            self.random.uniform(-jitter, jitter, (near.sum(), 2))
+        pos[far, 0] = self.random.uniform(x0, x0 + w, far.sum())
+        pos[far, 1] = self.random.uniform(y0, y0 + h, far.sum())
+
+    def forceLayout(self, width, height, iterations=20, onlyNew=False,
+                    margin=20, cells=16):
+        """
+        Force-directed layout in the width x height box. With onlyNew,
+        nodes that already have a position stay put and only the new ones
+        are moved into place.
+        """
+        n = self.count
+        if not n:
+            return
+        x0 = y0 = float(margin)
+        w, h = float(width - 2 * margin), float(height - 2 * margin)
+        pos = self.pos[:n]
+        new = numpy.isnan(pos[:, 0])
+        if new.any():
+            self._placeNew(new, x0, y0, w, h)
+        if onlyNew:
+            movers = numpy.flatnonzero(new)
+        else:
+            movers = numpy.arange(n)
+        if not len(movers):
+            return
+
+        edges = self.edgeList()
+        a, b = edges[:, 0], edges[:, 1]
+        k = numpy.sqrt(w * h / n)
+        k2 = numpy.float32(k * k)
+        temp = (onlyNew and k or max(w, h) / 10.0)
+        ncells = cells * cells
+
+        for it in range(iterations):
+            # Repulsion from the centroid of every occupied grid cell
+            gx = ((pos[:, 0] - x0) * (cells / w)).astype(numpy.int32)
+            gy = ((pos[:, 1] - y0) * (cells / h)).astype(numpy.int32)
+            cell = gy.clip(0, cells - 1) * cells + gx.clip(0, cells - 1)
+            mass = numpy.bincount(cell, minlength=ncells).astype(numpy.float32)
+            sx = numpy.bincount(cell, pos[:, 0], ncells).astype(numpy.float32)
+            sy = numpy.bincount(cell, pos[:, 1], ncells).astype(numpy.float32)
+            occupied = numpy.flatnonzero(mass)
+            m, cx, cy = mass[occupied], sx[occupied], sy[occupied]
+            cx /= m
+            cy /= m
+
+            p = pos[movers]
+            dx = p[:, 0, None] - cx[None, :]
+            dy = p[:, 1, None] - cy[None, :]
+            f = m / (dx * dx + dy * dy + 1e-2)
+            # A node must not push itself: swap its own cell's term for one
+            # from the centroid of the other nodes in that cell
+            own = numpy.searchsorted(occupied, cell[movers])
+            rows = numpy.arange(len(movers))
+            f[rows, own] = 0
+            mo = m[own] - 1
+            rest = numpy.maximum(mo, 1)
+            ox = numpy.where(mo > 0, (sx[cell[movers]] - p[:, 0]) / rest, p[:, 0])
+            oy = numpy.where(mo > 0, (sy[cell[movers]] - p[:, 1]) / rest, p[:, 1])
+            ddx, ddy = p[:, 0] - ox, p[:, 1] - oy
+            fo = mo / (ddx * ddx + ddy * ddy + 1e-2)
+            disp = numpy.zeros((n, 2), numpy.float32)
+            disp[movers, 0] = k2 * ((dx * f).sum(1) + ddx * fo)
+            disp[movers, 1] = k2 * ((dy * f).sum(1) + ddy * fo)
+
+            # Attraction along edges
+            ex = pos[a, 0] - pos[b, 0]
+            ey = pos[a, 1] - pos[b, 1]
+            dist = numpy.sqrt(ex * ex + ey * ey)
+            ex *= dist / k
+            ey *= dist / k
+            disp[:, 0] += numpy.bincount(b, ex, n) - numpy.bincount(a, ex, n)
+            disp[:, 1] += numpy.bincount(b, ey, n) - numpy.bincount(a, ey, n)
+
+            # Move, by at most the current temperature, and stay in the box
+            d = disp[movers]
+            length = numpy.sqrt((d * d).sum(1)) + 1e-6
+            d *= (numpy.minimum(length, temp) / length)[:, None]
+            p += d
+            p[:, 0] = p[:, 0].clip(x0, x0 + w)
+            p[:, 1] = p[:, 1].clip(y0, y0 + h)
+            pos[movers] = p
+            temp *= 1 - 1.0 / iterations
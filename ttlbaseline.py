@@ -0,0 +1,180 @@
+"""
+Streaming per-source TTL baseline and hop count anomaly detection.
+
+A host's packets reach the tap with the same TTL, give or take a hop,
+for as long as the route stays the same. A packet from a known source
+with a TTL well off its usual one was either sent by someone else with
+a forged source address or took a different route; either way it is
+worth seeing. TTLBaseline learns the usual TTL of every source from the
+traffic and flags such packets as they are added.
+
+Per source it keeps a streaming majority vote (Boyer-Moore): the usual
+TTL and a weight, raised by every packet within tolerance of it and
+lowered by every other one, the usual TTL being replaced when the
+weight runs out. That is O(1) per packet, and a route change that
+persists is learned after at most maxWeight packets. A packet is an
+anomaly when its source's weight is at least minWeight and its TTL is
+more than tolerance off the usual one.
+
+The table has a fixed number of slots and evicts an approximately least
+recently used source when full (CLOCK: a hand sweeps the slots, giving
+each recently used one a second chance), so millions of sources take
+bounded memory and an eviction costs O(1) on average. A source takes
+about 180 bytes, most of it the dict entry and address string that map
+it to its slot, so the default million slots need some 180 MB when full.
+
+usual serves displayfilter's usualttl for whole batches with array
+operations: each slot also holds its address key, and a sorted index of
+the keys, rebuilt at most every indexInterval seconds, is searched with
+searchsorted. Sources newer than the index count as unknown until then.
+
+    baseline = TTLBaseline(capacity=1 << 20)
+    if baseline.add(rec[1], rec[4]):
+        ...     # anomaly
+"""
+
+import array, time
+
+import numpy
+
+import displayfilter
+
+
+class TTLBaseline:
+
+    indexInterval = 1.0
+
+    def __init__(self, capacity=1 << 20, tolerance=1, minWeight=8,
+                 maxWeight=32):
+        self.capacity = capacity
+        self.tolerance = tolerance
+        self.minWeight = minWeight
+        self.maxWeight = maxWeight
+        # packed source address -> slot
+        self.slots = {}
+        # Per slot: its address, usual TTL, weight, CLOCK reference bit
+        # and packet and anomaly counts
+        self.addrs = [None] * capacity
+        self.usualTTL = bytearray(capacity)
+        self.weight = bytearray(capacity)
+        self.used = bytearray(capacity)
+        self.seen = array.array('L', [0]) * capacity
+        self.flagged = array.array('L', [0]) * capacity
+        # For usual: displayfilter.addressKey of each slot, array views of
+        # the per-slot bytes, and the sorted index, rebuilt when stale
+        self.keys = numpy.zeros(capacity, 'S17')
+        self.usualView = numpy.frombuffer(self.usualTTL, numpy.uint8)
+        self.weightView = numpy.frombuffer(self.weight, numpy.uint8)
+        self.allocated = 0
+        self.indexed = None
+        self.indexedAt = 0
+        self.sortedKeys = self.sortedSlots = None
+        self.hand = 0
+        self.evicted = 0
+        self.anomalies = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, src, ttl):
+        """
+        Learn from a packet from packed address src seen with ttl.
+        Returns True if the TTL is anomalous for src. Only one thread may
+        add; lookups from other threads are safe but may be a packet out
+        of date.
+        """
+        slot = self.slots.get(src)
+        if slot is None:
+            slot = self._allocate(src)
+            self.usualTTL[slot] = ttl
+            self.weight[slot] = 1
+            self.seen[slot] = 1
+            self.flagged[slot] = 0
+            return False
+        self.used[slot] = 1
+        self.seen[slot] += 1
+        usual = self.usualTTL[slot]
+        weight = self.weight[slot]
+        if abs(ttl - usual) <= self.tolerance:
+            if weight < self.maxWeight:
+                self.weight[slot] = weight + 1
+            return False
+        if weight > 1:
+            self.weight[slot] = weight - 1
+        else:
+            self.usualTTL[slot] = ttl
+        if weight < self.minWeight:
+            return False
+        self.flagged[slot] += 1
+        self.anomalies += 1
+        return True
+
+    def _allocate(self, src):
+        """ A slot for src, evicting the first not recently used source. """
+        slots = self.slots
+        if len(slots) < self.capacity:
+            slot = len(slots)
+        else:
+            used = self.used
+            hand = self.hand
+            while used[hand]:
+                used[hand] = 0
+                hand = (hand + 1) % self.capacity
+            slot = hand
+            self.hand = (hand + 1) % self.capacity
+            del slots[self.addrs[slot]]
+            self.evicted += 1
+        slots[src] = slot
+        self.addrs[slot] = src
+        self.keys[slot] = displayfilter.addressKey(src)
+        self.used[slot] = 0
+        self.allocated += 1
+        return slot
+
+    def lookup(self, src):
+        """
+        (usual TTL, weight, packets, anomalies) of packed address src, or
+        None if it is not in the table.
+        """
+        slot = self.slots.get(src)
+        if slot is None:
+            return None
+        return (self.usualTTL[slot], self.weight[slot], self.seen[slot],
+                self.flagged[slot])
+
+    def _index(self):
+        """ (sorted keys, their slots), rebuilt if sources came and went. """
+        now = time.time()
+        if self.indexed != self.allocated and \
+                now - self.indexedAt >= self.indexInterval:
+            n = len(self.slots)
+            order = numpy.argsort(self.keys[:n], kind='mergesort')
+            self.sortedKeys = self.keys[order]
+            self.sortedSlots = order
+            self.indexed = self.allocated
+            self.indexedAt = now
+        return self.sortedKeys, self.sortedSlots
+
+    def usual(self, keys, ttls):
+        """
+        Baseline for displayfilter's usualttl: the usual TTL of the source
+        of each of a batch of address keys, or the record's own TTL for
+        sources not (yet) known well enough to have one.
+        """
+        usual = numpy.array(ttls, numpy.uint8)
+        sortedKeys, sortedSlots = self._index()
+        if sortedKeys is None or not len(sortedKeys):
+            return usual
+        pos = numpy.searchsorted(sortedKeys, keys)
+        pos[pos == len(sortedKeys)] = 0
+        slot = sortedSlots[pos]
+        # A slot may have been given to another source since the index
+        # was built, so check its current key too
+        known = ((sortedKeys[pos] == keys) & (self.keys[slot] == keys) &
+                 (self.weightView[slot] >= self.minWeight))
+        usual[known] = self.usualView[slot[known]]
+        return usual
+
+    def status(self):
+        return 'sources %d/%d, evicted %d, anomalies %d' % (
+            len(self.slots), self.capacity, self.evicted, self.anomalies)
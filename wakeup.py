@@ -0,0 +1,56 @@
+"""
+Cross-thread wakeup of the GUI thread.
+
+The worker threads call notify when they have queued something; the GUI
+watches fileno() with QSocketNotifier (Qt) or createfilehandler (Tk) and
+calls clear before draining the queue. Wakeups are coalesced: however
+many messages are queued in between, at most one byte sits in the
+socketpair, and an idle GUI is not woken at all.
+"""
+
+import socket
+
+
+class Wakeup:
+
+    def __init__(self):
+        self.rsock, self.wsock = socket.socketpair()
+        self.rsock.setblocking(0)
+        self.wsock.setblocking(0)
+        self.pending = False
+
+    def fileno(self):
+        return self.rsock.fileno()
+
+    def notify(self):
+        """
+        Wake the GUI thread unless a wakeup is already pending. Callers
+        must have queued their data before calling this.
+        """
+        if not self.pending:
+            self.pending = True
+            try:
+                self.wsock.send('\0')
+            except socket.error:
+                # Buffer full, so the GUI has a wakeup coming anyway
+                pass
+
+    def clear(self):
+        """
+        Acknowledge a wakeup. Must be called before the queue is drained,
+        so that anything queued during the drain wakes the GUI again.
+        """
+        try:
+            while self.rsock.recv(4096):
+                pass
+        except socket.error:
+            pass
+        # Only now: a notify that came in while draining would otherwise
+        # have its byte swallowed, and every later one skipped as pending.
+        # One that is skipped before this queued its data before the
+        # drain that follows.
+        self.pending = False
+
+    def close(self):
+        self.rsock.close()
+        self.wsock.close()